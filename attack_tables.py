@@ -1,5 +1,6 @@
 from constants import *
 from bb_operations import *
+from table_cache import load_tables
 
 
 # PAWN ATTACKS
@@ -153,9 +154,7 @@ def set_occupancy(index, bits_in_mask, attack_mask):
 
     for count in range(bits_in_mask):
 
-        square = get_ls1b_index(attack_mask)
-
-        attack_mask = pop_bit(attack_mask, square)
+        square, attack_mask = pop_lsb(attack_mask)
 
         if index & (1 << count):
             occupancy |= BIT << square
@@ -231,17 +230,13 @@ bishop_magic_numbers = np.array([0x40040844404084,      0x2004208a004208,
                                  0x28000010020204,      0x6000020202d0240,      0x8918844842082200,
                                  0x401001102902002], dtype=np.uint64)
 
-rook_masks = np.fromiter((mask_rook_attacks(sq) for sq in squares), dtype=np.uint64)
-
-bishop_masks = np.fromiter((mask_bishop_attacks(sq) for sq in squares), dtype=np.uint64)
-
-
-@njit(nb.uint64[:, :](nb.uint64[:, :], nb.b1), cache=True)
-def init_sliders(attacks, bish):
-    """initialize bishop and rook attack tables with their magic numbers"""
+@njit(nb.uint64[:](nb.uint64[:], nb.uint64[:], nb.uint64[:], nb.b1), cache=True)
+def init_sliders(attacks, masks, offsets, bish):
+    """initialize bishop and rook attack tables with their magic numbers,
+    the attacks of each square starting at its offset in the flat table"""
 
     for sq in range(64):
-        attack_mask = bishop_masks[sq] if bish else rook_masks[sq]
+        attack_mask = masks[sq]
 
         relevant_bits_count = count_bits(attack_mask)
         occupancy_indices = 1 << relevant_bits_count
@@ -250,25 +245,72 @@ def init_sliders(attacks, bish):
             if bish:  # bishop
                 occupancy = set_occupancy(index, relevant_bits_count, attack_mask)
                 magic_index = (occupancy * bishop_magic_numbers[sq]) >> (64 - bishop_relevant_bits[sq])
-                attacks[sq][magic_index] = bishop_attacks_on_the_fly(sq, occupancy)
+                attacks[offsets[sq] + magic_index] = bishop_attacks_on_the_fly(sq, occupancy)
 
             else:  # rook
                 occupancy = set_occupancy(index, relevant_bits_count, attack_mask)
                 magic_index = (occupancy * rook_magic_numbers[sq]) >> (64 - rook_relevant_bits[sq])
-                attacks[sq][magic_index] = rook_attacks_on_the_fly(sq, occupancy)
+                attacks[offsets[sq] + magic_index] = rook_attacks_on_the_fly(sq, occupancy)
 
     return attacks
 
 
-# sliders
-bishop_attacks = init_sliders(np.empty((64, 512), dtype=np.uint64), bish=True)
-rook_attacks = init_sliders(np.empty((64, 4096), dtype=np.uint64), bish=False)
+@njit(nb.void(nb.uint64[:, :], nb.uint64[:, :]), cache=True)
+def init_lines(between, line):
+    """initialize the squares strictly between two aligned squares
+    and the full line going through them (empty if not aligned)"""
+
+    for sq1 in range(64):
+        for sq2 in range(64):
+            if sq1 == sq2:
+                continue
+            bb1 = set_bit(EMPTY, sq1)
+            bb2 = set_bit(EMPTY, sq2)
+
+            if bishop_attacks_on_the_fly(sq1, EMPTY) & bb2:
+                between[sq1][sq2] = bishop_attacks_on_the_fly(sq1, bb2) & bishop_attacks_on_the_fly(sq2, bb1)
+                line[sq1][sq2] = (bishop_attacks_on_the_fly(sq1, EMPTY) & bishop_attacks_on_the_fly(sq2, EMPTY)) \
+                    | bb1 | bb2
+
+            elif rook_attacks_on_the_fly(sq1, EMPTY) & bb2:
+                between[sq1][sq2] = rook_attacks_on_the_fly(sq1, bb2) & rook_attacks_on_the_fly(sq2, bb1)
+                line[sq1][sq2] = (rook_attacks_on_the_fly(sq1, EMPTY) & rook_attacks_on_the_fly(sq2, EMPTY)) \
+                    | bb1 | bb2
+
+
+def init_tables():
+    """generate all attack tables"""
+
+    rook_masks = np.fromiter((mask_rook_attacks(sq) for sq in squares), dtype=np.uint64)
+    bishop_masks = np.fromiter((mask_bishop_attacks(sq) for sq in squares), dtype=np.uint64)
 
-# leapers
-pawn_attacks = np.fromiter((mask_pawn_attacks(color, sq) for color in range(2) for sq in squares), dtype=np.uint64)
-pawn_attacks.shape = (2, 64)
-knight_attacks = np.fromiter((mask_knight_attacks(sq) for sq in squares), dtype=np.uint64)
-king_attacks = np.fromiter((mask_king_attacks(sq) for sq in squares), dtype=np.uint64)
+    # sliders, in flat tables sized after the relevant bits of each square ("fancy" magics):
+    # the rook table shrinks from 2MB to 800KB, small enough to be frozen into the cached code
+    bishop_sizes = 1 << bishop_relevant_bits.astype(np.uint64)
+    rook_sizes = 1 << rook_relevant_bits.astype(np.uint64)
+    bishop_offsets = np.cumsum(bishop_sizes) - bishop_sizes
+    rook_offsets = np.cumsum(rook_sizes) - rook_sizes
+    bishop_attacks = init_sliders(np.zeros(bishop_sizes.sum(), dtype=np.uint64), bishop_masks, bishop_offsets, True)
+    rook_attacks = init_sliders(np.zeros(rook_sizes.sum(), dtype=np.uint64), rook_masks, rook_offsets, False)
+
+    # leapers
+    pawn_attacks = np.fromiter((mask_pawn_attacks(color, sq) for color in range(2) for sq in squares),
+                               dtype=np.uint64)
+    pawn_attacks.shape = (2, 64)
+    knight_attacks = np.fromiter((mask_knight_attacks(sq) for sq in squares), dtype=np.uint64)
+    king_attacks = np.fromiter((mask_king_attacks(sq) for sq in squares), dtype=np.uint64)
+
+    # lines
+    between_squares = np.zeros((64, 64), dtype=np.uint64)
+    line_squares = np.zeros((64, 64), dtype=np.uint64)
+    init_lines(between_squares, line_squares)
+
+    return rook_masks, bishop_masks, bishop_offsets, rook_offsets, bishop_attacks, rook_attacks, \
+        pawn_attacks, knight_attacks, king_attacks, between_squares, line_squares
+
+
+rook_masks, bishop_masks, bishop_offsets, rook_offsets, bishop_attacks, rook_attacks, \
+    pawn_attacks, knight_attacks, king_attacks, between_squares, line_squares = load_tables("attack_tables", init_tables)
 
 
 @njit(nb.uint64(nb.uint8, nb.uint64), cache=True)
@@ -278,23 +320,23 @@ def get_bishop_attacks(sq, occ):
     occ &= bishop_masks[sq]
     occ *= bishop_magic_numbers[sq]
     occ >>= 64 - bishop_relevant_bits[sq]
-    return bishop_attacks[sq][occ]
+    return bishop_attacks[bishop_offsets[sq] + occ]
 
 
-@njit(nb.uint64(nb.uint8, nb.uint64))
+@njit(nb.uint64(nb.uint8, nb.uint64), cache=True)
 def get_rook_attacks(sq, occ):
     occ &= rook_masks[sq]
     occ *= rook_magic_numbers[sq]
     occ >>= 64 - rook_relevant_bits[sq]
-    return rook_attacks[sq][occ]
+    return rook_attacks[rook_offsets[sq] + occ]
 
 
-@njit(nb.uint64(nb.uint8, nb.uint64))
+@njit(nb.uint64(nb.uint8, nb.uint64), cache=True)
 def get_queen_attacks(sq, occ):
     return get_rook_attacks(sq, occ) | get_bishop_attacks(sq, occ)
 
 
-@njit
+@njit(cache=True)
 def get_attacks(piece, source, pos):
     """helper function to generate moves more efficiently"""
     if piece == knight:
@@ -309,7 +351,7 @@ def get_attacks(piece, source, pos):
         return king_attacks[source] & ~pos.occupancy[pos.side]
 
 
-@njit
+@njit(cache=True)
 def is_square_attacked(pos, sq, side):
     """return True if the square is attacked by the given color else False"""
     opp = side ^ 1
@@ -321,3 +363,16 @@ def is_square_attacked(pos, sq, side):
             or king_attacks[sq] & pos.pieces[side][king]:
         return True
     return False
+
+
+@njit(cache=True)
+def attackers_to(pos, sq, occ):
+    """return the pieces of both colors attacking the square, sliders being blocked by occ"""
+    return (pawn_attacks[black][sq] & pos.pieces[white][pawn]) \
+        | (pawn_attacks[white][sq] & pos.pieces[black][pawn]) \
+        | (knight_attacks[sq] & (pos.pieces[white][knight] | pos.pieces[black][knight])) \
+        | (get_bishop_attacks(sq, occ) & (pos.pieces[white][bishop] | pos.pieces[black][bishop]
+                                          | pos.pieces[white][queen] | pos.pieces[black][queen])) \
+        | (get_rook_attacks(sq, occ) & (pos.pieces[white][rook] | pos.pieces[black][rook]
+                                        | pos.pieces[white][queen] | pos.pieces[black][queen])) \
+        | (king_attacks[sq] & (pos.pieces[white][king] | pos.pieces[black][king]))
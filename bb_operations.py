@@ -34,18 +34,62 @@ def pop_bit(bb, sq):
     return bb & ~(1 << sq)
 
 
-@njit(nb.uint8(nb.uint64), cache=True)
-def count_bits(bb) -> int:
-    c = 0
-    while bb:
-        c += 1
-        bb &= bb - np.uint64(1)
-    return c
-
-
-@njit(nb.uint8(nb.uint64), cache=True)
-def get_ls1b_index(bb) -> int:
-    return count_bits((bb & -bb) - 1)
+# LLVM ctpop / cttz instructions, unavailable when the JIT is disabled
+try:
+    from llvmlite import ir
+    from numba.extending import intrinsic
+
+    HAS_INTRINSICS = not nb.config.DISABLE_JIT
+except ImportError:
+    HAS_INTRINSICS = False
+
+
+if HAS_INTRINSICS:
+    @intrinsic
+    def ctpop(typingctx, bb):
+        def codegen(context, builder, signature, args):
+            return builder.ctpop(args[0])
+        return nb.uint64(nb.uint64), codegen
+
+    @intrinsic
+    def cttz(typingctx, bb):
+        def codegen(context, builder, signature, args):
+            # defined for 0 (returns 64)
+            return builder.cttz(args[0], ir.Constant(ir.IntType(1), 0))
+        return nb.uint64(nb.uint64), codegen
+
+    @njit(nb.uint8(nb.uint64), cache=True)
+    def count_bits(bb) -> int:
+        return ctpop(bb)
+
+    @njit(nb.uint8(nb.uint64), cache=True)
+    def get_ls1b_index(bb) -> int:
+        return cttz(bb)
+
+else:
+    @njit(nb.uint8(nb.uint64), cache=True)
+    def count_bits(bb) -> int:
+        c = 0
+        while bb:
+            c += 1
+            bb &= bb - np.uint64(1)
+        return c
+
+    @njit(nb.uint8(nb.uint64), cache=True)
+    def get_ls1b_index(bb) -> int:
+        return count_bits((bb & -bb) - 1)
+
+
+@njit(nb.types.Tuple((nb.uint8, nb.uint64))(nb.uint64), cache=True)
+def pop_lsb(bb):
+    """return the index of the least significant bit and the bitboard without it"""
+    return get_ls1b_index(bb), bb & (bb - np.uint64(1))
+
+
+@njit(nb.uint64(nb.uint64, nb.int64), cache=True)
+def shift(bb, offset):
+    """move all the bits of a bitboard by offset squares, negative offsets go up the board"""
+    return bb << np.uint64(offset) if offset > 0 else bb >> np.uint64(-offset)
 
 
 def print_bb(bb):
@@ -0,0 +1,87 @@
+import os
+import subprocess
+import sys
+import time
+
+"""
+Startup time benchmark: time for a new process to be ready to search
+
+Each run is a fresh interpreter timing the import of the engine, the creation of a position
+and of a bot, and a first short search. The first run after a change of the engine compiles
+everything (cold), the next ones load the compiled code from the cache (warm).
+
+Search benchmark: nodes and time to search the test positions to a fixed depth,
+with given pruning margins of the bot (e.g. to measure the nodes saved by a pruning).
+"""
+
+STARTUP_SCRIPT = """
+import time
+t0 = time.perf_counter()
+from position import parse_fen
+from search import Black_numba, search
+from constants import start_position
+t1 = time.perf_counter()
+pos = parse_fen(start_position)
+bot = Black_numba()
+t2 = time.perf_counter()
+search(bot, pos, depth_limit=4)
+t3 = time.perf_counter()
+print(t1 - t0, t2 - t1, t3 - t2)
+"""
+
+
+def startup_time():
+    """return the import, setup and first search times (seconds) of a fresh process, and its total wall time"""
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT], cwd=os.path.dirname(os.path.abspath(__file__)),
+                         capture_output=True, text=True, check=True).stdout
+    total = time.perf_counter() - start
+    return (*map(float, out.split()[-3:]), total)
+
+
+def clear_jit_cache():
+    """remove the compiled code so that the next process compiles from scratch"""
+    from table_cache import JIT_CACHE_DIR
+    for name in os.listdir(JIT_CACHE_DIR) if os.path.isdir(JIT_CACHE_DIR) else ():
+        if name.endswith((".nbi", ".nbc")) or name == "jit_fingerprint":
+            os.remove(os.path.join(JIT_CACHE_DIR, name))
+
+
+def startup_benchmark(runs=3, cold=False):
+    """print the startup times of a cold process (if cold) and of warm ones"""
+    print("run      import   setup  search   total")
+    if cold:
+        clear_jit_cache()
+        print("cold    %7.3f %7.3f %7.3f %7.3f" % startup_time())
+    for i in range(runs):
+        print("warm %d  %7.3f %7.3f %7.3f %7.3f" % (i + 1, *startup_time()))
+
+
+def search_benchmark(depth=6, **margins):
+    """print the nodes and time to search each test position to depth,
+    the bot having the given pruning margins (e.g. delta_margin=10 ** 6 to turn delta pruning off)"""
+    from constants import FENS
+    from position import parse_fen
+    from search import Black_numba, search
+
+    total_nodes, total_time = 0, 0
+    for fen in FENS:
+        bot = Black_numba()
+        for name, margin in margins.items():
+            setattr(bot, name, margin)
+
+        start = time.perf_counter()
+        search(bot, parse_fen(fen), depth_limit=depth, time_limit=10 ** 9, node_limit=10 ** 12)
+        elapsed = time.perf_counter() - start
+
+        print("%10d %8.3f  %s" % (bot.nodes, elapsed, fen))
+        total_nodes += bot.nodes
+        total_time += elapsed
+    print("%10d %8.3f  total" % (total_nodes, total_time))
+
+
+if __name__ == "__main__":
+    if "--search" in sys.argv:
+        search_benchmark()
+    else:
+        startup_benchmark(cold="--cold" in sys.argv)
@@ -2,6 +2,12 @@ import numpy as np
 import numba as nb
 from numba import njit
 
+from table_cache import load_tables, clear_stale_jit_cache
+from polyglot import POLYGLOT_RANDOM, POLYGLOT_CASTLE, POLYGLOT_ENPASSANT, POLYGLOT_TURN
+
+# before any cached function of the engine is loaded
+clear_stale_jit_cache()
+
 EMPTY = np.uint64(0)
 BIT = np.uint64(1)
 UNIVERSE = np.uint64(0xFFFFFFFFFFFFFFFF)
@@ -9,6 +15,7 @@ UNIVERSE = np.uint64(0xFFFFFFFFFFFFFFFF)
 white, black, both = np.arange(3, dtype=np.uint8)
 
 pawn, knight, bishop, rook, queen, king = range(6)
+no_piece = 6
 
 (
     a8,    b8,    c8,    d8,    e8,    f8,    g8,    h8,
@@ -67,6 +74,15 @@ piece_to_letter = (("P", "N", "B", "R", "Q", "K"), ("p", "n", "b", "r", "q", "k"
 piece_to_ascii = (("♟", "♞", "♝", "♜", "♛", "♚"), ("♙", "♘", "♗", "♖", "♕", "♔"))
 
 wk, wq, bk, bq = (2 ** i for i in range(4))
+# Pawn moves of each side (white, black): square offsets (target - source),
+# white pawns go up the board towards a8 = 0
+pawn_push = (-8, 8)
+pawn_capture_west = (-9, 7)  # towards the A file
+pawn_capture_east = (-7, 9)  # towards the H file
+# target ranks of promotions, and of single pushes that can be pushed again
+promotion_ranks = np.array((rank8, rank1), dtype=np.uint64)
+double_push_ranks = np.array((rank3, rank6), dtype=np.uint64)
+
 castling_rights = np.array([15 for _ in range(64)], dtype=np.uint8)
 castling_rights[:8] = (7, 15, 15, 15, 3, 15, 15, 11)
 castling_rights[-8:] = (13, 15, 15, 15, 12, 15, 15, 14)
@@ -107,32 +123,104 @@ mvv_lva = np.array((
         (100, 200, 300, 400, 500, 600),
     ))
 
+# Static exchange evaluation piece values, the king never gets captured and no_piece is an empty square
+see_values = (100, 325, 325, 500, 975, 0, 0)
+
+# Move picker stages
+(
+    stage_hash_move, stage_gen_captures, stage_captures, stage_killers,
+    stage_gen_quiets, stage_quiets, stage_bad_captures, stage_done,
+) = range(8)
+
 # PV
 MAX_PLY = 64
 
-# LMR
+# Move buffers
+MAX_MOVES = 256
+
+# Undo stack (moves played in the game + moves searched)
+MAX_HISTORY = 1024
+
+# LMR: late quiet moves are reduced by lmr_table[depth][move number] plies (at least 1),
+# one less in PV nodes and for a move of good history
 full_depth_moves = 4
 reduction_limit = 3
+lmr_table = np.array([[0.5 + np.log(depth) * np.log(moves) / 3 if depth and moves else 0
+                       for moves in range(MAX_MOVES)] for depth in range(MAX_PLY)], dtype=np.int64)
+good_history = 64
+
+# Late move pruning: quiet moves after the first late_move_counts[depth] ones are not searched
+late_move_depth = 3
+late_move_counts = (0, 4, 7, 12)
+
+# Futility pruning: depths of the nodes pruned,
+# and default margins (centipawns) of the bot, per ply of depth for the futility ones.
+# Margins can be changed on a bot, a huge margin (e.g. 10 ** 6) turns a pruning off.
+futility_depth = 2
+reverse_futility_depth = 3
+FUTILITY_MARGIN = 150
+REVERSE_FUTILITY_MARGIN = 120
+DELTA_MARGIN = 200
 
 # Time
 time_precision = 2047
 
-# Hash Constants
-# init random hash keys
-piece_keys = np.random.randint(2 ** 64 - 1, size=(2, 6, 64), dtype=np.uint64)
-en_passant_keys = np.random.randint(2 ** 64 - 1, size=64, dtype=np.uint64)
-castle_keys = np.random.randint(2 ** 64 - 1, size=16, dtype=np.uint64)
-side_key = np.random.randint(2 ** 64 - 1, dtype=np.uint64)
+# Lazy SMP
+MAX_THREADS = 256
 
-MAX_HASH_SIZE = 0x400000
+# Hash Constants
+# Zobrist keys of Polyglot opening books: the hash keys are the same in every process
+# (and frozen in the cached compiled code) and match the keys of Polyglot books and tools.
+# The side key is hashed when white is to move, the en passant key only when a pawn can take
+piece_keys = np.array([[[POLYGLOT_RANDOM[64 * (2 * piece + (color == white)) + 8 * (7 - sq // 8) + sq % 8]
+                         for sq in range(64)] for piece in range(6)] for color in range(2)], dtype=np.uint64)
+en_passant_keys = np.array([POLYGLOT_RANDOM[POLYGLOT_ENPASSANT + sq % 8] for sq in range(64)], dtype=np.uint64)
+castle_keys = np.zeros(16, dtype=np.uint64)
+for rights in range(16):
+    for i in range(4):  # wk, wq, bk, bq
+        if rights >> i & 1:
+            castle_keys[rights] ^= POLYGLOT_RANDOM[POLYGLOT_CASTLE + i]
+side_key = POLYGLOT_RANDOM[POLYGLOT_TURN]
+
+# Transposition table: entries grouped in buckets (one cache line each),
+# sized in megabytes and rounded down to a power of two number of buckets
+DEFAULT_HASH_MB = 64
+MIN_HASH_MB, MAX_HASH_MB = 1, 4096
+HASH_BUCKET_SIZE = 4
 
 hash_flag_exact, hash_flag_alpha, hash_flag_beta = range(3)
 no_hash_entry = 100000
 
+# 16 bytes entries, the low bits of the hash key are the bucket index,
+# only the high 32 bits are stored to verify the position
 hash_numpy_type = np.dtype(
-    [("key", np.uint64), ("depth", np.uint8), ("flag", np.uint8), ("score", np.int64)]
+    [("key", np.uint32), ("move", np.uint32), ("score", np.int32),
+     ("depth", np.uint8), ("flag", np.uint8), ("age", np.uint16)]
 )
 hash_numba_type = nb.from_dtype(hash_numpy_type)
+HASH_ENTRY_SIZE = hash_numpy_type.itemsize
+
+# Pawn hash table (pawn structure scores from white perspective)
+PAWN_HASH_SIZE = 0x4000  # must be a power of two
+
+pawn_hash_numpy_type = np.dtype(
+    [("key", np.uint64), ("mg", np.int32), ("eg", np.int32),
+     ("white_passed", np.uint64), ("black_passed", np.uint64)]
+)
+pawn_hash_numba_type = nb.from_dtype(pawn_hash_numpy_type)
+
+# Evaluation cache (static evaluation from side-to-play perspective)
+EVAL_HASH_SIZE = 0x40000  # default number of entries, rounded down to a power of two
+
+eval_hash_numpy_type = np.dtype([("key", np.uint64), ("score", np.int32)])
+eval_hash_numba_type = nb.from_dtype(eval_hash_numpy_type)
+
+# Perft hash table (node count of a position at a given depth)
+PERFT_HASH_SIZE = 0x100000  # must be a power of two
+
+# the stored key is xor-ed with the count so that entries torn by other threads do not validate
+perft_hash_numpy_type = np.dtype([("key", np.uint64), ("count", np.uint64)])
+perft_hash_numba_type = nb.from_dtype(perft_hash_numpy_type)
 
 # Evaluation Constants
 
@@ -176,12 +264,10 @@ mirror_pst = (
        a b c d e f g h       a b c d e f g h       a b c d e f g h        a b c d e f g h
 """
 
-file_masks, rank_masks, isolated_masks, white_passed_masks, black_passed_masks = (
-    np.zeros(64, dtype=np.uint64) for _ in range(5)
-)
-
-
 def init_masks():
+    masks = tuple(np.zeros(64, dtype=np.uint64) for _ in range(5))
+    file_masks, rank_masks, isolated_masks, white_passed_masks, black_passed_masks = masks
+
     pointer = 0
     for i_rank, rank in enumerate(RANKS):
         for i_file, file in enumerate(FILES):
@@ -210,8 +296,10 @@ def init_masks():
 
             pointer += 1
 
+    return masks
+
 
-init_masks()
+file_masks, rank_masks, isolated_masks, white_passed_masks, black_passed_masks = load_tables("masks", init_masks)
 
 double_pawn_penalty = -20
 isolated_pawn_penalty = -10
@@ -239,17 +327,22 @@ pawns_on_bishop_colour_opening = (9, 6, 3, 0, -3, -6, -9, -12, -15)
 pawns_on_bishop_colour_endgame = (12, 8, 4, 0, -4, -8, -12, -16, -20)
 
 
-@njit
+@njit(cache=True)
 def manhattan_distance(sq1, sq2):
     F1, F2 = sq1 & 7, sq2 & 7
     R1, R2 = sq1 >> 3, sq2 >> 3
     return abs(R2 - R1) + abs(F2 - F1)
 
 
-arr_manhattan = np.array(
-    [manhattan_distance(sq1, sq2) for sq1 in range(64) for sq2 in range(64)],
-    dtype=np.uint8,
-)
-arr_manhattan.shape = (64, 64)
+def init_manhattan():
+    arr = np.array(
+        [manhattan_distance(sq1, sq2) for sq1 in range(64) for sq2 in range(64)],
+        dtype=np.uint8,
+    )
+    arr.shape = (64, 64)
+    return arr,
+
+
+arr_manhattan, = load_tables("manhattan", init_manhattan)
 
 stopped = False
@@ -1,17 +1,12 @@
 from constants import *
 from bb_operations import *
-from position import Position
+from position import position_type
 from attack_tables import get_bishop_attacks, get_queen_attacks, king_attacks, knight_attacks, get_rook_attacks
-from pst import PST
 
 
-@njit(nb.uint16(Position.class_type.instance_type), cache=True)
+@njit(nb.uint16(position_type), cache=True)
 def get_game_phase_score(pos):
-    score = 0
-    for color in (black, white):
-        for piece in range(knight, king):
-            score += count_bits(pos.pieces[color][piece]) * phase_scores[piece]
-    return (score * 256 + (TOTAL_PHASE / 2)) / TOTAL_PHASE
+    return (pos.phase * 256 + (TOTAL_PHASE / 2)) / TOTAL_PHASE
 
 
 @njit(cache=True)
@@ -58,7 +53,7 @@ def knight_eg(pos, sq, kings_sq, opp, color):
     return v
 
 
-@njit
+@njit(cache=True)
 def queen_mg(pos, sq, kings_sq, opp):
     v = 0
     # mobility (-19 to 19)
@@ -69,7 +64,7 @@ def queen_mg(pos, sq, kings_sq, opp):
     return v
 
 
-@njit
+@njit(cache=True)
 def queen_eg(pos, sq, kings_sq, opp):
     v = 0
     # mobility (-38 to 38)
@@ -80,7 +75,7 @@ def queen_eg(pos, sq, kings_sq, opp):
     return v
 
 
-@njit
+@njit(cache=True)
 def rook_mg(pos, sq, kings_sq, opp, color):
     v = 0
     # Semi-open file
@@ -97,7 +92,7 @@ def rook_mg(pos, sq, kings_sq, opp, color):
     return v
 
 
-@njit
+@njit(cache=True)
 def rook_eg(pos, sq, kings_sq, opp, color):
     v = 0
     # Semi-open file
@@ -134,7 +129,54 @@ def pawn_mg(pos, sq, opp, color):
     return v
 
 
-@njit
+@njit(nb.types.UniTuple(nb.int64, 2)(position_type, pawn_hash_numba_type[::1]), cache=True)
+def evaluate_pawns(pos, pawn_table):
+    """return pawn structure scores (middle-game, endgame) from white perspective,
+    probing the pawn hash table first"""
+
+    entry = pos.pawn_key & (PAWN_HASH_SIZE - 1)
+    if pawn_table[entry].key == pos.pawn_key:
+        return pawn_table[entry].mg, pawn_table[entry].eg
+
+    mg_score = 0
+    eg_score = 0
+
+    for color in (black, white):
+
+        opp = color ^ 1
+        passed = EMPTY
+
+        # double pawns
+        double_pawns = count_bits(pos.pieces[color][pawn] & (pos.pieces[color][pawn] << 8))
+        mg_score += double_pawns * double_pawn_penalty
+
+        bb = pos.pieces[color][pawn]
+        while bb:
+            sq, bb = pop_lsb(bb)
+
+            # isolated and passed pawns
+            v = pawn_mg(pos, sq, opp, color)
+            mg_score += v
+            eg_score += v
+
+            passed_mask = black_passed_masks[sq] if color else white_passed_masks[sq]
+            if not passed_mask & pos.pieces[opp][pawn]:
+                passed = set_bit(passed, sq)
+
+        if color:
+            pawn_table[entry].black_passed = passed
+            mg_score, eg_score = -mg_score, -eg_score
+        else:
+            pawn_table[entry].white_passed = passed
+
+    pawn_table[entry].key = pos.pawn_key
+    pawn_table[entry].mg = mg_score
+    pawn_table[entry].eg = eg_score
+
+    return mg_score, eg_score
+
+
+@njit(cache=True)
 def king_mg(pos, sq, opp, color):
     v = 0
     # Semi-open file
@@ -161,10 +203,14 @@ def king_eg(pos, sq, opp, color):
     return v
 
 
-# @njit(nb.int64(Position.class_type.instance_type, nb.b1))
-@njit
-def evaluate(pos, lazy=False) -> int:
-    """return evaluation of a position from side-to-play perspective"""
+@njit([nb.float64(position_type, pawn_hash_numba_type[::1], nb.b1),
+       nb.float64(position_type, pawn_hash_numba_type[::1], nb.types.Omitted(False))], cache=True)
+def evaluate(pos, pawn_table, lazy=False) -> int:
+    """return evaluation of a position from side-to-play perspective
+
+    Material and PST scores are kept up to date by make_move,
+    pawn structure scores are cached in pawn_table,
+    only the dynamic terms are computed here."""
     mg_score = 0
     eg_score = 0
 
@@ -175,38 +221,23 @@ def evaluate(pos, lazy=False) -> int:
 
         opp = color ^ 1
 
-        # double pawns
-        double_pawns = count_bits(pos.pieces[color][pawn] & (pos.pieces[color][pawn] << 8))
-        mg_score += double_pawns * double_pawn_penalty
         # bishop counter
         bish = 0
 
-        for piece in range(6):
+        # pawns are evaluated with the pawn hash table
+        for piece in range(knight, 6):
+            if lazy:  # material, PST and pawn structure scores only
+                break
+
             bb = pos.pieces[color][piece]
 
             while bb:
-                sq = get_ls1b_index(bb)
-
-                # Material score
-                mg_score += material_scores[opening][piece]
-                eg_score += material_scores[end_game][piece]
-
-                # Positional score
-                mg_score += PST[opening][piece][sq]
-                eg_score += PST[end_game][piece][sq]
-
-                if lazy:
-                    bb = pop_bit(bb, sq)
-                    continue
+                sq, bb = pop_lsb(bb)
 
                 if piece == king:
                     mg_score += king_mg(pos, sq, opp, color)
                     eg_score += king_eg(pos, sq, opp, color)
 
-                elif piece == pawn:
-                    mg_score += pawn_mg(pos, sq, opp, color)
-                    eg_score += pawn_mg(pos, sq, opp, color)
-
                 elif piece == rook:
                     mg_score += rook_mg(pos, sq, kings_sq, opp, color)
                     eg_score += rook_eg(pos, sq, kings_sq, opp, color)
@@ -224,8 +255,6 @@ def evaluate(pos, lazy=False) -> int:
                     mg_score += bishop_mg(pos, sq, kings_sq, opp)
                     eg_score += bishop_eg(pos, sq, kings_sq, opp)
 
-                bb = pop_bit(bb, sq)
-
         if bish > 1:
             mg_score += bishop_pair_mg
             eg_score += bishop_pair_eg
@@ -233,6 +262,15 @@ def evaluate(pos, lazy=False) -> int:
         if color:
             mg_score, eg_score = -mg_score, -eg_score
 
+    # Material and positional scores
+    mg_score += pos.mg_score
+    eg_score += pos.eg_score
+
+    # Pawn structure
+    pawns_mg, pawns_eg = evaluate_pawns(pos, pawn_table)
+    mg_score += pawns_mg
+    eg_score += pawns_eg
+
     # Initiative
     if game_phase_score > 50:
         mg_score -= 30 if pos.side else -30
@@ -0,0 +1,80 @@
+import functools
+
+import numba as nb
+from numba import njit, types
+from numba.experimental import structref
+from numba.extending import intrinsic, overload_method
+
+"""
+StructRef helpers, to use numba StructRef types like jitclasses
+
+Unlike jitclass instances, StructRef instances can be passed to functions cached
+on disk (cache=True), so that a new process does not recompile the engine.
+"""
+
+
+@intrinsic
+def _set_field(typingctx, struct, name, value):
+    """struct.<name> = value, name being a literal string"""
+    if not isinstance(name, types.StringLiteral):
+        return None
+    attr = name.literal_value
+
+    def codegen(context, builder, signature, args):
+        setattr_impl = context.get_setattr(attr, nb.none(struct, value))
+        setattr_impl(builder, (args[0], args[2]))
+        return context.get_dummy_value()
+
+    return nb.none(struct, name, value), codegen
+
+
+def field_property(proxy_class, struct_type, name, field_type):
+    """property reading and writing one field, through a getter and a setter
+    compiled (or loaded from the cache) on first use, not when the module is imported"""
+
+    def get_field(struct):
+        return getattr(struct, name)
+
+    def set_field(struct, value):
+        _set_field(struct, name, value)
+
+    # one cache index per struct, so that loading it does not import the modules of other structs
+    get_field.__qualname__ = f"{proxy_class.__name__}.get_field"
+    set_field.__qualname__ = f"{proxy_class.__name__}.set_field"
+
+    @functools.cache
+    def getter():
+        return njit(field_type(struct_type), cache=True)(get_field)
+
+    @functools.cache
+    def setter():
+        return njit(nb.none(struct_type, field_type), cache=True)(set_field)
+
+    return property(lambda struct: getter()(struct), lambda struct, value: setter()(struct, value))
+
+
+class JitStruct(structref.StructRefProxy):
+    """Python side of a StructRef, its fields are the properties added by define_fields"""
+
+
+def define_fields(struct_type, proxy_class):
+    """make the fields of the StructRef readable and writable as attributes of proxy_class"""
+    for name, field_type in struct_type.field_dict.items():
+        setattr(proxy_class, name, field_property(proxy_class, struct_type, name, field_type))
+
+
+def method_typer(func):
+    """overload_method typing function returning func as the implementation"""
+    @functools.wraps(func)
+    def typer(*args, **kwargs):
+        return func
+    return typer
+
+
+def define_methods(struct_type, proxy_class, *names):
+    """make the methods of proxy_class callable on the StructRef in jitted code,
+    and compiled (cached) when called from Python"""
+    for name in names:
+        func = getattr(proxy_class, name)
+        overload_method(struct_type, name)(method_typer(func))
+        setattr(proxy_class, name, njit(cache=True)(func))
@@ -1,4 +1,5 @@
 import berserk
+import os
 import time
 import chess.polyglot
 import requests
@@ -13,6 +14,8 @@ from bb_operations import count_bits
 
 API_TOKEN = open("api_token.txt").read()
 bot_id = 'black_numba'
+# transposition table kept from game to game
+HASH_FILE = "black_numba_hash.npy"
 
 session = berserk.TokenSession(API_TOKEN)
 client = berserk.Client(session=session)
@@ -28,6 +31,11 @@ class Game:
         self.time_str = "wtime" if self.bot_is_white else "btime"
         self.moves = ""
         self.bot = Black_numba()
+        if os.path.exists(HASH_FILE):
+            try:
+                self.bot.load_hash(HASH_FILE)
+            except (OSError, ValueError) as e:
+                print(f"cannot load hash: {e}")
         self.pos = parse_fen(start_position)
         self.theory = True
         self.book_moves = 0
@@ -51,7 +59,7 @@ class Game:
             for smove in move_list:
                 self.pcb.push_uci(smove)
                 move = parse_move(self.pos, smove)
-                self.pos = make_move(self.pos, move)
+                make_move(self.pos, move)
             print(self.current_state)
             self.play(remaining_time=self.current_state['state'][self.time_str] // 1000)
 
@@ -68,7 +76,7 @@ class Game:
                     if not event['moves'] == self.moves:
                         s_move = event['moves'][len(self.moves):].strip()
                         self.moves = event['moves']
-                        self.pos = make_move(self.pos, parse_move(self.pos, s_move))
+                        make_move(self.pos, parse_move(self.pos, s_move))
                         self.pcb.push_uci(s_move)
                         remaining_time = event[self.time_str].timestamp()
                         bot_turn = self.bot_is_white != self.pos.side
@@ -194,6 +202,10 @@ for event in client.bots.stream_incoming_events():
         game_id = event['game']['id']
         game = Game(client=client, game_id=game_id)
         game.run()
+        try:
+            game.bot.save_hash(HASH_FILE)
+        except OSError as e:
+            print(f"cannot save hash: {e}")
         del game
 
     else:  # challengeDeclined, gameFinish, challengeCanceled
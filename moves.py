@@ -1,9 +1,10 @@
 import sys
 
-from attack_tables import is_square_attacked, get_attacks, pawn_attacks
+from attack_tables import is_square_attacked, get_attacks, pawn_attacks, get_bishop_attacks, get_rook_attacks, \
+    attackers_to, between_squares, line_squares
 from constants import *
 from bb_operations import *
-from position import Position, generate_hash_key
+from position import position_type, generate_hash_key, update_piece_score, enpas_key
 
 """
            Binary move bits             Meaning          Hexadecimal
@@ -113,345 +114,588 @@ def print_attacked_square(pos, side):
     print_bb(attacked)
 
 
-@njit
-def generate_moves(pos):
-    """return a list of pseudo legal moves from a given Position"""
-
-    # TODO: integrate the constants to be able to compile AOT
-
-    move_list = []
-
-    for piece in range(6):
-        bb = pos.pieces[pos.side][piece]
-        opp = pos.side ^ 1
-
-        # white pawns & king castling moves
-        if pos.side == white:
-            if piece == pawn:
-                while bb:
-                    # pawn move
-                    source = get_ls1b_index(bb)
-                    target = source - 8
-
-                    # quiet pawn move
-                    if not target < a8 and not get_bit(pos.occupancy[both], target):
-
-                        # promotion
-                        if a7 <= source <= h7:
-                            move_list.append(encode_move(source, target, piece, pos.side, queen, 0, 0, 0, 0))
-                            move_list.append(encode_move(source, target, piece, pos.side, rook, 0, 0, 0, 0))
-                            move_list.append(encode_move(source, target, piece, pos.side, bishop, 0, 0, 0, 0))
-                            move_list.append(encode_move(source, target, piece, pos.side, knight, 0, 0, 0, 0))
-
-                        else:
-                            # push
-                            move_list.append(encode_move(source, target, piece, pos.side, 0, 0, 0, 0, 0))
-
-                            # push push
-                            if a2 <= source <= h2 and not get_bit(pos.occupancy[both], target - 8):
-                                move_list.append(
-                                    encode_move(source, target - 8, piece, pos.side, 0, 0, 1, 0, 0))
-
-                    # pawn attack tables
-                    attacks = pawn_attacks[white][source] & pos.occupancy[black]
-
-                    while attacks:
-                        target = get_ls1b_index(attacks)
-
-                        # promotion capture
-                        if a7 <= source <= h7:
-                            move_list.append(encode_move(source, target, piece, pos.side, queen, 1, 0, 0, 0))
-                            move_list.append(encode_move(source, target, piece, pos.side, rook, 1, 0, 0, 0))
-                            move_list.append(encode_move(source, target, piece, pos.side, bishop, 1, 0, 0, 0))
-                            move_list.append(encode_move(source, target, piece, pos.side, knight, 1, 0, 0, 0))
-                        # capture
-                        else:
-                            move_list.append(encode_move(source, target, piece, pos.side, 0, 1, 0, 0, 0))
-
-                        attacks = pop_bit(attacks, target)
-
-                    # en-passant
-                    if pos.enpas != no_sq:
-                        enpas_attacks = pawn_attacks[white][source] & (BIT << pos.enpas)
-
-                        if enpas_attacks:
-                            target_enpas = get_ls1b_index(enpas_attacks)
-                            move_list.append(encode_move(source, target_enpas, piece, pos.side, 0, 1, 0, 1, 0))
-
-                    bb = pop_bit(bb, source)
-
-            if piece == king:
-                if pos.castle & wk:
-                    # are squares empty
-                    if not get_bit(pos.occupancy[both], f1) and not get_bit(pos.occupancy[both], g1):
-                        # are squares safe
-                        if not is_square_attacked(pos, e1, black) and not is_square_attacked(pos, f1, black):
-                            move_list.append(encode_move(e1, g1, piece, pos.side, 0, 0, 0, 0, 1))
-
-                if pos.castle & wq:
-                    # squares are empty
-                    if not get_bit(pos.occupancy[both], d1) and not get_bit(pos.occupancy[both], c1) and not get_bit(
-                            pos.occupancy[both], b1):
-                        # squares are not attacked by black
-                        if not is_square_attacked(pos, e1, black) and not is_square_attacked(pos, d1, black):
-                            move_list.append(encode_move(e1, c1, piece, pos.side, 0, 0, 0, 0, 1))
-
-        # black pawns & king castling moves
-        if pos.side == black:
-            if piece == pawn:
-                while bb:
-                    source = get_ls1b_index(bb)
-                    target = source + 8
-
-                    # quiet pawn move
-                    if not target > h1 and not get_bit(pos.occupancy[both], target):
-
-                        # Promotion
-                        if a2 <= source <= h2:
-                            move_list.append(encode_move(source, target, piece, pos.side, queen, 0, 0, 0, 0))
-                            move_list.append(encode_move(source, target, piece, pos.side, rook, 0, 0, 0, 0))
-                            move_list.append(encode_move(source, target, piece, pos.side, bishop, 0, 0, 0, 0))
-                            move_list.append(encode_move(source, target, piece, pos.side, knight, 0, 0, 0, 0))
-
-                        else:
-                            # push
-                            move_list.append(encode_move(source, target, piece, pos.side, 0, 0, 0, 0, 0))
-
-                            # push push
-                            if a7 <= source <= h7 and not get_bit(pos.occupancy[both], target + 8):
-                                move_list.append(
-                                    encode_move(source, target + 8, piece, pos.side, 0, 0, 1, 0, 0))
-
-                    # pawn attack tables
-                    attacks = pawn_attacks[black][source] & pos.occupancy[white]
-
-                    while attacks:
-                        target = get_ls1b_index(attacks)
-
-                        # promotion capture
-                        if a2 <= source <= h2:
-                            move_list.append(encode_move(source, target, piece, pos.side, queen, 1, 0, 0, 0))
-                            move_list.append(encode_move(source, target, piece, pos.side, rook, 1, 0, 0, 0))
-                            move_list.append(encode_move(source, target, piece, pos.side, bishop, 1, 0, 0, 0))
-                            move_list.append(encode_move(source, target, piece, pos.side, knight, 1, 0, 0, 0))
-                        # capture
-                        else:
-                            move_list.append(encode_move(source, target, piece, pos.side, 0, 1, 0, 0, 0))
-
-                        attacks = pop_bit(attacks, target)
-
-                    # en-passant
-                    if pos.enpas != no_sq:
-                        enpas_attacks = pawn_attacks[black][source] & (BIT << pos.enpas)
-
-                        if enpas_attacks:
-                            target_enpas = get_ls1b_index(enpas_attacks)
-                            move_list.append(encode_move(source, target_enpas, piece, pos.side, 0, 1, 0, 1, 0))
-
-                    bb = pop_bit(bb, source)
-
-            if piece == king:  # target square will be checked later with legality
-                if pos.castle & bk:
-                    # squares are empty
-                    if not get_bit(pos.occupancy[both], f8) and not get_bit(pos.occupancy[both], g8):
-                        # squares are not attacked by black
-                        if not is_square_attacked(pos, e8, white) and not is_square_attacked(pos, f8, white):
-                            move_list.append(encode_move(e8, g8, piece, pos.side, 0, 0, 0, 0, 1))
-
-                if pos.castle & bq:
-                    # squares are empty
-                    if not get_bit(pos.occupancy[both], d8) and not get_bit(pos.occupancy[both], c8) and not get_bit(
-                            pos.occupancy[both], b8):
-                        # squares are not attacked by white
-                        if not is_square_attacked(pos, e8, white) and not is_square_attacked(pos, d8, white):
-                            move_list.append(encode_move(e8, c8, piece, pos.side, 0, 0, 0, 0, 1))
-
-        if piece in range(1, 6):
-            while bb:
-                source = get_ls1b_index(bb)
-                attacks = get_attacks(piece, source, pos)
-
-                while attacks != EMPTY:
-                    target = get_ls1b_index(attacks)
-
-                    # quiet
-                    if not get_bit(pos.occupancy[opp], target):
-                        move_list.append(encode_move(source, target, piece, pos.side, 0, 0, 0, 0, 0))
-
-                    # capture
-                    else:
-                        move_list.append(encode_move(source, target, piece, pos.side, 0, 1, 0, 0, 0))
-
-                    attacks = pop_bit(attacks, target)
-
-                bb = pop_bit(bb, source)
-
-    return move_list
+@njit(nb.int64(nb.uint64[::1], nb.int64, nb.uint64, nb.int64, nb.uint8, nb.int64, nb.int64), cache=True)
+def add_pawn_moves(move_list, count, targets, offset, side, capture, double):
+    """add to move_list the pawn moves to each of the targets, coming from target - offset,
+    four promotions on the last rank, return the new number of moves"""
+    while targets:
+        target, targets = pop_lsb(targets)
+        source = target - offset
 
+        if get_bit(promotion_ranks[side], target):
+            for promote_to in (queen, rook, bishop, knight):
+                move_list[count] = encode_move(source, target, pawn, side, promote_to, capture, 0, 0, 0)
+                count += 1
+        else:
+            move_list[count] = encode_move(source, target, pawn, side, 0, capture, double, 0, 0)
+            count += 1
 
-def generate_legal_moves(pos):
-    """very inefficient, use only to debug"""
-    return [move for move in generate_moves(pos) if make_move(pos, move)]
-
-
-# (Position.class_type.instance_type(Position.class_type.instance_type, nb.uint64, nb.b1))
-@njit
-def make_move(pos_orig, move, only_captures=False):
-    """return new updated position if (move is legal) else None"""
-
-    # TODO: integrate the constants to be able to compile AOT
-
-    # create a copy of the position
-    pos = Position()
-    pos.pieces = pos_orig.pieces.copy()
-    pos.side = pos_orig.side
-    pos.enpas = pos_orig.enpas
-    pos.castle = pos_orig.castle
-    pos.hash_key = pos_orig.hash_key
-
-    # quiet moves
-    if not only_captures:
-
-        # parse move
-        source_square = get_move_source(move)
-        target_square = get_move_target(move)
-        piece = get_move_piece(move)
-        side = get_move_side(move)
-        opp = side ^ 1
-        promote_to = get_move_promote_to(move)
-        capture = get_move_capture(move)
-        double_push = get_move_double(move)
-        enpas = get_move_enpas(move)
-        castling = get_move_castling(move)
-
-        # Actual Move
+    return count
 
-        # update bitboards
-        pos.pieces[side][piece] = pop_bit(pos.pieces[side][piece], source_square)
-        pos.pieces[side][piece] = set_bit(pos.pieces[side][piece], target_square)
 
-        # update hash key
-        pos.hash_key ^= piece_keys[side][piece][source_square]
-        pos.hash_key ^= piece_keys[side][piece][target_square]
+@njit(nb.int64(position_type, nb.uint64[::1]), cache=True)
+def generate_captures(pos, move_list):
+    """fill move_list with the pseudo legal captures, en-passant and promotions
+    of a given Position, return the number of moves generated
 
-        if capture:  # find what we captured and erase it
-            for opp_piece in range(6):
-                if get_bit(pos.pieces[opp][opp_piece], target_square):
-                    # update bitboards
-                    pos.pieces[opp][opp_piece] = pop_bit(pos.pieces[opp][opp_piece], target_square)
-                    # update hash key
-                    pos.hash_key ^= piece_keys[opp][opp_piece][target_square]
-                    break
+    Targets are masked with the opponent occupancy so that quiescence search
+    never builds quiet moves."""
 
-        if promote_to:  # erase pawn and place promoted piece
-            pos.pieces[side][piece] = pop_bit(pos.pieces[side][piece], target_square)
-            pos.hash_key ^= piece_keys[side][piece][target_square]
+    side = pos.side
+    opp = side ^ 1
 
-            pos.pieces[side][promote_to] = set_bit(pos.pieces[side][promote_to], target_square)
-            pos.hash_key ^= piece_keys[side][promote_to][target_square]
+    # pawns, all at once: quiet promotions, then captures towards each side
+    pawns = pos.pieces[side][pawn]
+    push = pawn_push[side]
+    west = pawn_capture_west[side]
+    east = pawn_capture_east[side]
 
-        if enpas:  # erase the opp pawn
-            if side:  # black just moved
-                pos.pieces[opp][piece] = pop_bit(pos.pieces[opp][piece], target_square - 8)
-                pos.hash_key ^= piece_keys[opp][piece][target_square - 8]
+    promotions = shift(pawns, push) & ~pos.occupancy[both] & promotion_ranks[side]
+    count = add_pawn_moves(move_list, 0, promotions, push, side, 0, 0)
+    count = add_pawn_moves(move_list, count, shift(pawns & ~fileA, west) & pos.occupancy[opp], west, side, 1, 0)
+    count = add_pawn_moves(move_list, count, shift(pawns & ~fileH, east) & pos.occupancy[opp], east, side, 1, 0)
 
-            else:  # white just moved
-                pos.pieces[opp][piece] = pop_bit(pos.pieces[opp][piece], target_square + 8)
-                pos.hash_key ^= piece_keys[opp][piece][target_square + 8]
+    # en-passant, from the squares a pawn of the opponent would attack the en passant square from
+    if pos.enpas != no_sq:
+        sources = pawn_attacks[opp][pos.enpas] & pawns
+        while sources:
+            source, sources = pop_lsb(sources)
+            move_list[count] = encode_move(source, pos.enpas, pawn, side, 0, 1, 0, 1, 0)
+            count += 1
 
-        if pos.enpas != no_sq:
-            pos.hash_key ^= en_passant_keys[pos.enpas]
+    for piece in range(knight, king + 1):
+        bb = pos.pieces[side][piece]
 
-        # reset enpas
-        pos.enpas = no_sq
+        while bb:
+            source, bb = pop_lsb(bb)
+            attacks = get_attacks(piece, source, pos) & pos.occupancy[opp]
 
-        if double_push:  # set en-passant square
-            if side:  # black just moved
-                pos.enpas = target_square - 8
-                pos.hash_key ^= en_passant_keys[target_square - 8]
-            else:  # white just moved
-                pos.enpas = target_square + 8
-                pos.hash_key ^= en_passant_keys[target_square + 8]
+            while attacks:
+                target, attacks = pop_lsb(attacks)
+                move_list[count] = encode_move(source, target, piece, side, 0, 1, 0, 0, 0)
+                count += 1
 
-        if castling:  # move rook accordingly
-            if target_square == g1:
-                pos.pieces[side][rook] = pop_bit(pos.pieces[side][rook], h1)
-                pos.pieces[side][rook] = set_bit(pos.pieces[side][rook], f1)
+    return count
 
-                pos.hash_key ^= piece_keys[side][rook][h1]
-                pos.hash_key ^= piece_keys[side][rook][f1]
 
-            elif target_square == c1:
-                pos.pieces[side][rook] = pop_bit(pos.pieces[side][rook], a1)
-                pos.pieces[side][rook] = set_bit(pos.pieces[side][rook], d1)
+@njit(cache=True)
+def is_castling_legal(pos, target):
+    """return True if the side to move can castle with its king going to target"""
 
-                pos.hash_key ^= piece_keys[side][rook][a1]
-                pos.hash_key ^= piece_keys[side][rook][d1]
+    if target == g1:
+        # right, squares are empty, squares are not attacked by black
+        return bool(pos.castle & wk) and not get_bit(pos.occupancy[both], f1) and not get_bit(pos.occupancy[both], g1) \
+            and not is_square_attacked(pos, e1, black) and not is_square_attacked(pos, f1, black)
 
-            elif target_square == g8:
-                pos.pieces[side][rook] = pop_bit(pos.pieces[side][rook], h8)
-                pos.pieces[side][rook] = set_bit(pos.pieces[side][rook], f8)
+    if target == c1:
+        return bool(pos.castle & wq) and not get_bit(pos.occupancy[both], d1) and not get_bit(pos.occupancy[both], c1) \
+            and not get_bit(pos.occupancy[both], b1) \
+            and not is_square_attacked(pos, e1, black) and not is_square_attacked(pos, d1, black)
+
+    if target == g8:
+        return bool(pos.castle & bk) and not get_bit(pos.occupancy[both], f8) and not get_bit(pos.occupancy[both], g8) \
+            and not is_square_attacked(pos, e8, white) and not is_square_attacked(pos, f8, white)
 
-                pos.hash_key ^= piece_keys[side][rook][h8]
-                pos.hash_key ^= piece_keys[side][rook][f8]
+    if target == c8:
+        return bool(pos.castle & bq) and not get_bit(pos.occupancy[both], d8) and not get_bit(pos.occupancy[both], c8) \
+            and not get_bit(pos.occupancy[both], b8) \
+            and not is_square_attacked(pos, e8, white) and not is_square_attacked(pos, d8, white)
 
-            elif target_square == c8:
-                pos.pieces[side][rook] = pop_bit(pos.pieces[side][rook], a8)
-                pos.pieces[side][rook] = set_bit(pos.pieces[side][rook], d8)
+    return False
 
-                pos.hash_key ^= piece_keys[side][rook][a8]
-                pos.hash_key ^= piece_keys[side][rook][d8]
 
-        # reset castling hash
-        pos.hash_key ^= castle_keys[pos.castle]
+@njit(nb.int64(position_type, nb.uint64[::1]), cache=True)
+def generate_quiets(pos, move_list):
+    """fill move_list with the pseudo legal quiet moves (no captures nor promotions)
+    of a given Position, return the number of moves generated"""
 
-        # update castling rights
-        pos.castle &= castling_rights[source_square]
-        pos.castle &= castling_rights[target_square]
+    side = pos.side
+    empty = ~pos.occupancy[both]
 
-        # update castling hash
-        pos.hash_key ^= castle_keys[pos.castle]
+    # pawn pushes, all at once (promotions are generated with the captures)
+    push = pawn_push[side]
+    pushes = shift(pos.pieces[side][pawn], push) & empty
+    count = add_pawn_moves(move_list, 0, pushes & ~promotion_ranks[side], push, side, 0, 0)
+    count = add_pawn_moves(move_list, count, shift(pushes & double_push_ranks[side], push) & empty, 2 * push, side, 0, 1)
 
-        # update occupancy
-        for color in range(2):
-            for bb in pos.pieces[color]:
-                pos.occupancy[color] |= bb
-            pos.occupancy[both] |= pos.occupancy[color]
+    # castling, the king target square will be checked later with legality
+    king_square = e1 if side == white else e8
+    for target in (g1, c1) if side == white else (g8, c8):
+        if is_castling_legal(pos, target):
+            move_list[count] = encode_move(king_square, target, king, side, 0, 0, 0, 0, 1)
+            count += 1
 
-        pos.side = opp
-        pos.hash_key ^= side_key
+    for piece in range(knight, king + 1):
+        bb = pos.pieces[side][piece]
 
-        if not is_square_attacked(pos, get_ls1b_index(pos.pieces[side][king]), opp):
-            return pos
+        while bb:
+            source, bb = pop_lsb(bb)
+            attacks = get_attacks(piece, source, pos) & empty
 
-    # Capturing moves
-    else:
-        if get_move_capture(move):
-            return make_move(pos, move, only_captures=False)
-        return None
+            while attacks != EMPTY:
+                target, attacks = pop_lsb(attacks)
+                move_list[count] = encode_move(source, target, piece, side, 0, 0, 0, 0, 0)
+                count += 1
+
+    return count
+
+
+@njit(nb.int64(position_type, nb.uint64[::1]), cache=True)
+def generate_moves(pos, move_list):
+    """fill move_list with the pseudo legal moves of a given Position,
+    return the number of moves generated"""
+    count = generate_captures(pos, move_list)
+    return count + generate_quiets(pos, move_list[count:])
+
+
+@njit(nb.b1(position_type, nb.uint64), cache=True)
+def is_pseudo_legal(pos, move):
+    """return True if the move (e.g. coming from the PV or a killer slot)
+    could have been generated in the given Position"""
+
+    source = get_move_source(move)
+    target = get_move_target(move)
+    piece = get_move_piece(move)
+    side = get_move_side(move)
+    opp = side ^ 1
+    promote_to = get_move_promote_to(move)
+    capture = get_move_capture(move)
+
+    if not move or side != pos.side or piece > king or not get_bit(pos.pieces[side][piece], source):
+        return False
+
+    if get_move_castling(move):
+        return piece == king and source == (e8 if side else e1) and (target == source + 2 or target + 2 == source) \
+            and is_castling_legal(pos, target)
+
+    if get_move_enpas(move):
+        return piece == pawn and target == pos.enpas and get_bit(pawn_attacks[side][source], target)
+
+    # a capture needs an enemy piece on the target square, a quiet move an empty one
+    if capture and not get_bit(pos.occupancy[opp], target):
+        return False
+    if not capture and get_bit(pos.occupancy[both], target):
+        return False
+
+    if piece != pawn:
+        return not promote_to and not get_move_double(move) and get_bit(get_attacks(piece, source, pos), target)
+
+    # promotions happen on the last rank only
+    if bool(promote_to) != bool(get_bit(rank8 | rank1, target)) or promote_to > queen:
+        return False
+
+    if capture:
+        return get_bit(pawn_attacks[side][source], target)
+
+    step = 8 if side else -8
+    if get_move_double(move):
+        start_rank = rank7 if side else rank2
+        return get_bit(start_rank, source) and target == source + 2 * step and \
+            not get_bit(pos.occupancy[both], source + step)
+
+    return target == source + step
+
+
+@njit(nb.types.UniTuple(nb.uint64, 2)(position_type), cache=True)
+def get_checkers_and_pinned(pos):
+    """return the enemy pieces giving check to the side to move
+    and the pieces of the side to move pinned to their king"""
+
+    side = pos.side
+    opp = side ^ 1
+    king_sq = get_ls1b_index(pos.pieces[side][king])
+
+    checkers = attackers_to(pos, king_sq, pos.occupancy[both]) & pos.occupancy[opp]
+
+    # enemy sliders that would attack the king on an empty board
+    snipers = (get_bishop_attacks(king_sq, EMPTY) & (pos.pieces[opp][bishop] | pos.pieces[opp][queen])) \
+        | (get_rook_attacks(king_sq, EMPTY) & (pos.pieces[opp][rook] | pos.pieces[opp][queen]))
+
+    pinned = EMPTY
+    while snipers:
+        sniper, snipers = pop_lsb(snipers)
+        blockers = between_squares[king_sq][sniper] & pos.occupancy[both]
+
+        # a single blocker of our color is pinned
+        if blockers and not blockers & (blockers - BIT) and blockers & pos.occupancy[side]:
+            pinned |= blockers
+
+    return checkers, pinned
+
+
+@njit(nb.b1(position_type, nb.uint64, nb.uint64, nb.uint64), cache=True)
+def is_legal(pos, move, checkers, pinned):
+    """return True if the pseudo legal move does not leave the king in check,
+    checkers and pinned are computed once per Position by get_checkers_and_pinned"""
+
+    source = get_move_source(move)
+    target = get_move_target(move)
+    side = pos.side
+    opp = side ^ 1
+    king_sq = get_ls1b_index(pos.pieces[side][king])
+
+    if get_move_piece(move) == king:
+        # castling squares were checked by the generator, the king itself must not block a slider
+        return not attackers_to(pos, target, pop_bit(pos.occupancy[both], source)) & pos.occupancy[opp]
+
+    if get_move_enpas(move):
+        # two pawns leave the same rank, look for a discovered slider attack
+        captured = target + 8 if side == white else target - 8
+        occ = set_bit(pop_bit(pop_bit(pos.occupancy[both], source), captured), target)
+        return not attackers_to(pos, king_sq, occ) & pop_bit(pos.occupancy[opp], captured)
+
+    if checkers:
+        # double check, only the king can move
+        if checkers & (checkers - BIT):
+            return False
+        # capture the checker or block its line
+        if not get_bit(checkers | between_squares[king_sq][get_ls1b_index(checkers)], target):
+            return False
+
+    # a pinned piece stays on the line of its king
+    return not get_bit(pinned, source) or get_bit(line_squares[king_sq][source], target)
+
+
+@njit(nb.b1(position_type, nb.uint64, nb.int64), cache=True)
+def see_ge(pos, move, threshold):
+    """return True if the static exchange evaluation of the move is at least threshold
+
+    Both sides take turns capturing on the target square with their least valuable attacker,
+    each being free to stop. Sliders behind a capturing piece join in (x-rays)."""
+
+    # en passant, castling and promotions count as even
+    if get_move_enpas(move) or get_move_castling(move) or get_move_promote_to(move):
+        return threshold <= 0
+
+    source = get_move_source(move)
+    target = get_move_target(move)
+
+    # not enough even if the captured piece comes for free
+    swap = see_values[pos.board[target]] - threshold
+    if swap < 0:
+        return False
+    # enough even if the capturing piece is lost
+    swap = see_values[pos.board[source]] - swap
+    if swap <= 0:
+        return True
+
+    occ = pos.occupancy[both] ^ (BIT << source) ^ (BIT << target)
+    attackers = attackers_to(pos, target, occ)
+    diagonal = pos.pieces[white][bishop] | pos.pieces[black][bishop] | pos.pieces[white][queen] \
+        | pos.pieces[black][queen]
+    straight = pos.pieces[white][rook] | pos.pieces[black][rook] | pos.pieces[white][queen] \
+        | pos.pieces[black][queen]
+
+    side = pos.side
+    result = 1
+    while True:
+        side ^= 1
+        attackers &= occ
+        side_attackers = attackers & pos.occupancy[side]
+        if not side_attackers:
+            break
+        result ^= 1
+
+        # least valuable attacker
+        piece = pawn
+        while not side_attackers & pos.pieces[side][piece]:
+            piece += 1
+
+        if piece == king:
+            # the king can only take if the square is not defended anymore
+            return bool(result ^ 1) if attackers & pos.occupancy[side ^ 1] else bool(result)
 
-    return None
+        swap = see_values[piece] - swap
+        if swap < result:
+            break
+
+        occ = pop_bit(occ, get_ls1b_index(side_attackers & pos.pieces[side][piece]))
 
+        # uncover the sliders behind
+        if piece == pawn or piece == bishop or piece == queen:
+            attackers |= get_bishop_attacks(target, occ) & diagonal
+        if piece == rook or piece == queen:
+            attackers |= get_rook_attacks(target, occ) & straight
+
+    return bool(result)
 
-@njit
-def make_null_move(pos_orig):
-    """return a position with no enpas sq and flipped sides"""
 
-    pos = Position()
-    pos.pieces = pos_orig.pieces.copy()
-    pos.occupancy = pos_orig.occupancy.copy()
-    pos.castle = pos_orig.castle
+@njit(nb.int64(position_type, nb.uint64[::1]), cache=True)
+def generate_legal(pos, move_list):
+    """fill move_list with the legal moves of a given Position,
+    return the number of moves generated"""
+
+    count = generate_moves(pos, move_list)
+    checkers, pinned = get_checkers_and_pinned(pos)
+
+    legal_count = 0
+    for i in range(count):
+        if is_legal(pos, move_list[i], checkers, pinned):
+            move_list[legal_count] = move_list[i]
+            legal_count += 1
+
+    return legal_count
 
-    pos.side = pos_orig.side ^ 1
+
+def generate_legal_moves(pos):
+    """legal moves as a list, use only to debug"""
+    move_list = np.zeros(MAX_MOVES, dtype=np.uint64)
+    return list(move_list[:generate_legal(pos, move_list)])
+
+
+@njit(cache=True)
+def move_castling_rook(pos, side, target_square):
+    """move the rook of a castling move, toggling it back when unmaking"""
+    if target_square == g1:
+        rook_from, rook_to = h1, f1
+    elif target_square == c1:
+        rook_from, rook_to = a1, d1
+    elif target_square == g8:
+        rook_from, rook_to = h8, f8
+    else:
+        rook_from, rook_to = a8, d8
+
+    pos.pieces[side][rook] ^= (BIT << rook_from) | (BIT << rook_to)
+    pos.occupancy[side] ^= (BIT << rook_from) | (BIT << rook_to)
+    pos.board[rook_from], pos.board[rook_to] = pos.board[rook_to], pos.board[rook_from]
+
+    return rook_from, rook_to
+
+
+@njit(nb.void(position_type, nb.uint64), cache=True)
+def unmake_move(pos, move):
+    """take back the last move made on the position"""
+
+    source_square = get_move_source(move)
+    target_square = get_move_target(move)
+    piece = get_move_piece(move)
+    side = get_move_side(move)
+    opp = side ^ 1
+    promote_to = get_move_promote_to(move)
+
+    # restore irreversible state
+    pos.undo_index -= 1
+    i = pos.undo_index
+    pos.enpas = pos.undo_enpas[i]
+    pos.castle = pos.undo_castle[i]
+    pos.hash_key = pos.undo_hash[i]
+    pos.pawn_key = pos.undo_pawn_key[i]
+    pos.mg_score = pos.undo_mg_score[i]
+    pos.eg_score = pos.undo_eg_score[i]
+    pos.phase = pos.undo_phase[i]
+    pos.halfmove = pos.undo_halfmove[i]
+    pos.null_distance = pos.undo_null_distance[i]
+    pos.side = side
+
+    # move the piece back
+    if promote_to:
+        pos.pieces[side][promote_to] = pop_bit(pos.pieces[side][promote_to], target_square)
+    else:
+        pos.pieces[side][piece] = pop_bit(pos.pieces[side][piece], target_square)
+    pos.pieces[side][piece] = set_bit(pos.pieces[side][piece], source_square)
+    pos.occupancy[side] ^= (BIT << source_square) | (BIT << target_square)
+    pos.board[source_square] = piece
+    pos.board[target_square] = no_piece
+
+    if get_move_enpas(move):  # put back the opp pawn
+        captured_square = target_square - 8 if side else target_square + 8
+        pos.pieces[opp][pawn] = set_bit(pos.pieces[opp][pawn], captured_square)
+        pos.occupancy[opp] = set_bit(pos.occupancy[opp], captured_square)
+        pos.board[captured_square] = pawn
+
+    elif pos.undo_captured[i] != no_piece:  # put back the captured piece
+        captured = pos.undo_captured[i]
+        pos.pieces[opp][captured] = set_bit(pos.pieces[opp][captured], target_square)
+        pos.occupancy[opp] = set_bit(pos.occupancy[opp], target_square)
+        pos.board[target_square] = captured
+
+    if get_move_castling(move):  # move the rook back
+        move_castling_rook(pos, side, target_square)
+
+    pos.occupancy[both] = pos.occupancy[white] | pos.occupancy[black]
+
+
+@njit([nb.b1(position_type, nb.uint64, nb.b1), nb.b1(position_type, nb.uint64, nb.types.Omitted(False))], cache=True)
+def make_move(pos, move, legal=False):
+    """make the move on the position in place,
+    return True if the move is legal else undo it and return False
+
+    A move already known to be legal (see is_legal) skips the king safety check."""
+
+    # parse move
+    source_square = get_move_source(move)
+    target_square = get_move_target(move)
+    piece = get_move_piece(move)
+    side = get_move_side(move)
+    opp = side ^ 1
+    promote_to = get_move_promote_to(move)
+    capture = get_move_capture(move)
+    double_push = get_move_double(move)
+    enpas = get_move_enpas(move)
+    castling = get_move_castling(move)
+
+    # save irreversible state
+    i = pos.undo_index
+    assert i < MAX_HISTORY, "undo stack full"
+    pos.undo_captured[i] = no_piece
+    pos.undo_enpas[i] = pos.enpas
+    pos.undo_castle[i] = pos.castle
+    pos.undo_hash[i] = pos.hash_key
+    pos.undo_pawn_key[i] = pos.pawn_key
+    pos.undo_mg_score[i] = pos.mg_score
+    pos.undo_eg_score[i] = pos.eg_score
+    pos.undo_phase[i] = pos.phase
+    pos.undo_halfmove[i] = pos.halfmove
+    pos.undo_null_distance[i] = pos.null_distance
+    pos.undo_index += 1
+
+    # the en passant key depends on the pawns of the side to move, remove it before they move
+    pos.hash_key ^= enpas_key(pos)
+
+    # Actual Move
+
+    # read the captured piece before the moving piece takes its square
+    captured = pos.board[target_square]
+
+    # update bitboards
+    pos.pieces[side][piece] = pop_bit(pos.pieces[side][piece], source_square)
+    pos.pieces[side][piece] = set_bit(pos.pieces[side][piece], target_square)
+    pos.occupancy[side] ^= (BIT << source_square) | (BIT << target_square)
+    pos.board[source_square] = no_piece
+    pos.board[target_square] = piece
+
+    # update hash key
+    pos.hash_key ^= piece_keys[side][piece][source_square]
+    pos.hash_key ^= piece_keys[side][piece][target_square]
+
+    # update material and PST scores
+    update_piece_score(pos, side, piece, source_square, -1)
+    update_piece_score(pos, side, piece, target_square, 1)
+
+    if piece == pawn:
+        pos.pawn_key ^= piece_keys[side][pawn][source_square]
+        pos.pawn_key ^= piece_keys[side][pawn][target_square]
+
+    if enpas:  # erase the opp pawn
+        # behind the target square, seen from the side that just moved
+        captured_square = target_square - 8 if side else target_square + 8
+        pos.pieces[opp][pawn] = pop_bit(pos.pieces[opp][pawn], captured_square)
+        pos.occupancy[opp] = pop_bit(pos.occupancy[opp], captured_square)
+        pos.board[captured_square] = no_piece
+        pos.hash_key ^= piece_keys[opp][pawn][captured_square]
+        pos.pawn_key ^= piece_keys[opp][pawn][captured_square]
+        update_piece_score(pos, opp, pawn, captured_square, -1)
+
+    elif capture:  # erase the captured piece
+        # update bitboards
+        pos.pieces[opp][captured] = pop_bit(pos.pieces[opp][captured], target_square)
+        pos.occupancy[opp] = pop_bit(pos.occupancy[opp], target_square)
+        # update hash key
+        pos.hash_key ^= piece_keys[opp][captured][target_square]
+        if captured == pawn:
+            pos.pawn_key ^= piece_keys[opp][pawn][target_square]
+        # update scores
+        update_piece_score(pos, opp, captured, target_square, -1)
+        pos.phase -= phase_scores[captured]
+        pos.undo_captured[i] = captured
+
+    if promote_to:  # erase pawn and place promoted piece
+        pos.pieces[side][piece] = pop_bit(pos.pieces[side][piece], target_square)
+        pos.hash_key ^= piece_keys[side][piece][target_square]
+        pos.pawn_key ^= piece_keys[side][piece][target_square]
+        update_piece_score(pos, side, piece, target_square, -1)
+
+        pos.pieces[side][promote_to] = set_bit(pos.pieces[side][promote_to], target_square)
+        pos.board[target_square] = promote_to
+        pos.hash_key ^= piece_keys[side][promote_to][target_square]
+        update_piece_score(pos, side, promote_to, target_square, 1)
+        pos.phase += phase_scores[promote_to]
+
+    # captures and pawn moves are irreversible
+    if capture or piece == pawn:
+        pos.halfmove = 0
+    else:
+        pos.halfmove += 1
+    pos.null_distance += 1
+
+    # reset enpas
     pos.enpas = no_sq
-    pos.hash_key = pos_orig.hash_key
+
+    if double_push:  # set en-passant square
+        if side:  # black just moved
+            pos.enpas = target_square - 8
+        else:  # white just moved
+            pos.enpas = target_square + 8
+
+    if castling:  # move rook accordingly
+        rook_from, rook_to = move_castling_rook(pos, side, target_square)
+
+        pos.hash_key ^= piece_keys[side][rook][rook_from]
+        pos.hash_key ^= piece_keys[side][rook][rook_to]
+
+        update_piece_score(pos, side, rook, rook_from, -1)
+        update_piece_score(pos, side, rook, rook_to, 1)
+
+    # reset castling hash
+    pos.hash_key ^= castle_keys[pos.castle]
+
+    # update castling rights
+    pos.castle &= castling_rights[source_square]
+    pos.castle &= castling_rights[target_square]
+
+    # update castling hash
+    pos.hash_key ^= castle_keys[pos.castle]
+
+    pos.occupancy[both] = pos.occupancy[white] | pos.occupancy[black]
+
+    pos.side = opp
+    pos.hash_key ^= side_key
+    pos.hash_key ^= enpas_key(pos)
+
+    if not legal and is_square_attacked(pos, get_ls1b_index(pos.pieces[side][king]), opp):
+        unmake_move(pos, move)
+        return False
+
+    return True
+
+
+@njit(nb.void(position_type), cache=True)
+def make_null_move(pos):
+    """remove the enpas sq and flip sides in place"""
+
+    i = pos.undo_index
+    assert i < MAX_HISTORY, "undo stack full"
+    pos.undo_captured[i] = no_piece
+    pos.undo_enpas[i] = pos.enpas
+    pos.undo_castle[i] = pos.castle
+    pos.undo_hash[i] = pos.hash_key
+    pos.undo_halfmove[i] = pos.halfmove
+    pos.undo_null_distance[i] = pos.null_distance
+    pos.undo_index += 1
+
+    # repetitions are not looked for across a null move,
+    # the halfmove clock goes on for the fifty-move rule
+    pos.null_distance = 0
 
     # update hash table
-    if pos_orig.enpas != no_sq:
-        pos.hash_key ^= en_passant_keys[pos_orig.enpas]
+    pos.hash_key ^= enpas_key(pos)
     pos.hash_key ^= side_key
 
-    return pos
+    pos.side ^= 1
+    pos.enpas = no_sq
+
+
+@njit(nb.void(position_type), cache=True)
+def unmake_null_move(pos):
+    """take back the last null move made on the position"""
+
+    pos.undo_index -= 1
+    i = pos.undo_index
+    pos.enpas = pos.undo_enpas[i]
+    pos.hash_key = pos.undo_hash[i]
+    pos.halfmove = pos.undo_halfmove[i]
+    pos.null_distance = pos.undo_null_distance[i]
+    pos.side ^= 1
 
 
 def parse_move(pos, uci_move: str) -> int:
@@ -460,13 +704,14 @@ def parse_move(pos, uci_move: str) -> int:
     source = (ord(uci_move[0]) - ord('a')) + ((8 - int(uci_move[1])) * 8)
     target = (ord(uci_move[2]) - ord('a')) + ((8 - int(uci_move[3])) * 8)
 
-    for move in generate_moves(pos):
+    move_list = np.zeros(MAX_MOVES, dtype=np.uint64)
+    for move in move_list[:generate_moves(pos, move_list)]:
         if get_move_source(move) == source and get_move_target(move) == target:
             promoted_piece = get_move_promote_to(move)
             if promoted_piece:
-                for p, s in enumerate(('n', 'b', 'r', 'q'), 1):
-                    if promoted_piece == p and uci_move[4] == s:
-                        return move
-                return 0    # in case of illegal promotion (e.g. e7d8f)
+                # one move per promotion piece, 0 in case of illegal promotion (e.g. e7d8f)
+                if len(uci_move) > 4 and uci_move[4] == " nbrq"[promoted_piece]:
+                    return move
+                continue
             return move
     return 0
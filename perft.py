@@ -1,13 +1,15 @@
 import time
 import chess
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 from constants import *
-from position import parse_fen
-from moves import generate_moves, make_move, generate_legal_moves, get_move_uci
+from position import parse_fen, copy_position, position_type
+from moves import generate_legal, make_move, unmake_move, generate_legal_moves, get_move_uci
 
 
-positions = nb.typed.Dict.empty(key_type=nb.types.string, value_type=nb.types.uint64[:])
+# only read from Python, a numba typed dict would be compiled at every import
+positions = {}
 
 positions["rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"] = \
     np.array([1, 20, 400,  8902,  197281,  4865609,   119060324], dtype=np.uint64)
@@ -42,7 +44,9 @@ def debug_perft(board, depth, b, print_info=False):
 
     for m in moves:
         b.push_uci(get_move_uci(m))
-        c = debug_perft(make_move(board, m), depth - 1, b)
+        make_move(board, m)
+        c = debug_perft(board, depth - 1, b)
+        unmake_move(board, m)
         count += c
         b.pop()
         if print_info:
@@ -71,39 +75,79 @@ def debug_iterative_perft(depth_max=3):
             assert r == result
 
 
-@njit
-def compiled_perft(board, depth):
-    """fast compiled perft test"""
+def new_perft_table(hashed=True):
+    """return a perft hash table, empty (no hashing) for pure move generation benchmarks"""
+    return np.zeros(PERFT_HASH_SIZE if hashed else 0, dtype=perft_hash_numpy_type)
+
+
+@njit(nb.uint64(position_type, nb.int64, nb.uint64[:, ::1], perft_hash_numba_type[::1]), nogil=True, cache=True)
+def compiled_perft(board, depth, move_lists, perft_table):
+    """fast compiled perft test, move_lists holds one move buffer per depth,
+    subtrees counts are cached in perft_table unless it is empty"""
     if depth == 0:
-        return 1
-    count = 0
-    moves = generate_moves(board)
-    for m in moves:
-        new_board = make_move(board, m)
-        if new_board is not None:
-            c = compiled_perft(new_board, depth - 1)
-            count += c
+        return np.uint64(1)
+
+    moves = move_lists[depth]
+
+    # bulk counting, leaves are never made
+    if depth == 1:
+        return np.uint64(generate_legal(board, moves))
+
+    hashed = perft_table.size > 0
+    # the same position at another depth is another entry
+    key = board.hash_key ^ np.uint64(depth)
+    index = key & np.uint64(perft_table.size - 1)
+    if hashed:
+        # copy the entry first, another thread may be writing it
+        entry_key, entry_count = perft_table[index].key, perft_table[index].count
+        if entry_key ^ entry_count == key:
+            return entry_count
+
+    count = np.uint64(0)
+    for i in range(generate_legal(board, moves)):
+        m = moves[i]
+        make_move(board, m, True)
+        count += compiled_perft(board, depth - 1, move_lists, perft_table)
+        unmake_move(board, m)
+
+    if hashed:
+        perft_table[index].count = count
+        perft_table[index].key = key ^ count
+
     return count
 
 
-def uci_perft(pos, depth):
+@njit(nb.uint64(position_type, nb.uint64, nb.int64, perft_hash_numba_type[::1]), nogil=True, cache=True)
+def root_move_perft(pos, move, depth, perft_table):
+    """perft of the subtree of a legal root move, on a copy of the position
+    so that root moves can be counted in parallel threads"""
+    board = copy_position(pos)
+    make_move(board, move)
+    return compiled_perft(board, depth - 1, np.zeros((MAX_PLY, MAX_MOVES), dtype=np.uint64), perft_table)
+
+
+def divide_perft(pos, depth, threads=1, hashed=True):
+    """return the perft count of each legal root move, root moves being split across threads
+    sharing the same perft hash table"""
+    moves = generate_legal_moves(pos)
+    perft_table = new_perft_table(hashed)
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        counts = pool.map(lambda m: root_move_perft(pos, m, depth, perft_table), moves)
+    return {get_move_uci(m): c for m, c in zip(moves, counts)}
+
+
+def uci_perft(pos, depth, threads=1, hashed=True):
     """fast compiled perft test"""
-    moves = generate_moves(pos)
-    total = 0
     t = time.perf_counter()
-    for m in moves:
-        count = 0
-        new_board = make_move(pos, m)
-        if new_board is not None:
-            c = compiled_perft(new_board, depth - 1)
-            count += c
+    total = 0
+    for move, count in divide_perft(pos, depth, threads, hashed).items():
         total += count
-        print(f"{get_move_uci(m)}: {count}")
+        print(f"{move}: {count}")
     print("\nnodes searched:", total)
     print(f"perft speed: {total / 1000 / (time.perf_counter() - t):.3f} kn/s")
 
 
-def fast_iterative_perft(depth_max=4):
+def fast_iterative_perft(depth_max=4, threads=1, hashed=False):
     for i, (pos, t) in enumerate(positions.items(), 1):
         print("-" * 30)
         print(" " * 8, "POSITION", i)
@@ -114,7 +158,11 @@ def fast_iterative_perft(depth_max=4):
             if depth > depth_max:
                 continue
             s = time.time()
-            r = compiled_perft(position, depth)
+            if depth and threads > 1:
+                r = sum(divide_perft(position, depth, threads, hashed).values())
+            else:
+                r = compiled_perft(position, depth, np.zeros((MAX_PLY, MAX_MOVES), dtype=np.uint64),
+                                   new_perft_table(hashed))
             if depth > 2:
                 print("depth     time         Mn/s")
                 print(f"  {depth}        {time.time() - s:.3f}      {result / (time.time() - s) / 10**6:.2f}")
@@ -1,30 +1,127 @@
 from constants import *
 from bb_operations import *
-from numba.experimental import jitclass
+from pst import PST
+from attack_tables import pawn_attacks
+from numba.experimental import structref
+from jit_struct import JitStruct, define_fields
 
 position_spec = [
-    ("pieces", nb.uint64[:, :]),
-    ("occupancy", nb.uint64[:]),
+    ("pieces", nb.uint64[:, ::1]),
+    ("occupancy", nb.uint64[::1]),
+    ("board", nb.uint8[::1]),
     ("side", nb.uint8),
     ("enpas", nb.uint8),
     ("castle", nb.uint8),
     ("hash_key", nb.uint64),
+    ("pawn_key", nb.uint64),
+    ("mg_score", nb.int32),
+    ("eg_score", nb.int32),
+    ("phase", nb.uint8),
+    ("halfmove", nb.uint16),
+    ("null_distance", nb.uint16),
+    ("undo_index", nb.uint16),
+    ("undo_captured", nb.uint8[::1]),
+    ("undo_enpas", nb.uint8[::1]),
+    ("undo_castle", nb.uint8[::1]),
+    ("undo_hash", nb.uint64[::1]),
+    ("undo_pawn_key", nb.uint64[::1]),
+    ("undo_mg_score", nb.int32[::1]),
+    ("undo_eg_score", nb.int32[::1]),
+    ("undo_phase", nb.uint8[::1]),
+    ("undo_halfmove", nb.uint16[::1]),
+    ("undo_null_distance", nb.uint16[::1]),
 ]
 
 
-@jitclass(position_spec)
-class Position:
-    def __init__(self):
-        self.pieces = np.zeros(
-            (2, 6), dtype=np.uint64
-        )  # bb for each color (2) and each piece type (6)
-        self.occupancy = np.zeros(
-            3, dtype=np.uint64
-        )  # Combined bitboards for (white, black, both)
-        self.side = 0
-        self.enpas = no_sq
-        self.castle = 0
-        self.hash_key = 0
+@structref.register
+class PositionType(nb.types.StructRef):
+    pass
+
+
+class Position(JitStruct):
+    def __new__(cls):
+        return new_position()
+
+
+structref.define_boxing(PositionType, Position)
+position_type = PositionType(position_spec)
+define_fields(position_type, Position)
+
+
+@njit(position_type(), cache=True)
+def new_position():
+    """return an empty Position"""
+    pos = structref.new(position_type)
+    pos.pieces = np.zeros(
+        (2, 6), dtype=np.uint64
+    )  # bb for each color (2) and each piece type (6)
+    pos.occupancy = np.zeros(
+        3, dtype=np.uint64
+    )  # Combined bitboards for (white, black, both)
+    # Piece type on each square (no_piece if empty), the color is given by occupancy
+    pos.board = np.full(64, no_piece, dtype=np.uint8)
+    pos.side = 0
+    pos.enpas = no_sq
+    pos.castle = 0
+    pos.hash_key = 0
+    # Hash key of the pawns only, for the pawn hash table
+    pos.pawn_key = 0
+    # Material + PST scores from white perspective (middle-game, endgame)
+    pos.mg_score = 0
+    pos.eg_score = 0
+    # Sum of the phase_scores of the pieces on the board
+    pos.phase = 0
+    # Plies since the last capture or pawn move (fifty-move rule, repetitions)
+    pos.halfmove = 0
+    # Plies since the last null move, or since the position was set up
+    pos.null_distance = 0
+    # Undo stack, one entry per move made on this position
+    pos.undo_index = 0
+    pos.undo_captured = np.zeros(MAX_HISTORY, dtype=np.uint8)
+    pos.undo_enpas = np.zeros(MAX_HISTORY, dtype=np.uint8)
+    pos.undo_castle = np.zeros(MAX_HISTORY, dtype=np.uint8)
+    pos.undo_hash = np.zeros(MAX_HISTORY, dtype=np.uint64)
+    pos.undo_pawn_key = np.zeros(MAX_HISTORY, dtype=np.uint64)
+    pos.undo_mg_score = np.zeros(MAX_HISTORY, dtype=np.int32)
+    pos.undo_eg_score = np.zeros(MAX_HISTORY, dtype=np.int32)
+    pos.undo_phase = np.zeros(MAX_HISTORY, dtype=np.uint8)
+    pos.undo_halfmove = np.zeros(MAX_HISTORY, dtype=np.uint16)
+    pos.undo_null_distance = np.zeros(MAX_HISTORY, dtype=np.uint16)
+    return pos
+
+
+@njit(position_type(position_type), cache=True)
+def copy_position(pos):
+    """return an independent copy of a position, e.g. for another search thread"""
+
+    new_pos = new_position()
+    new_pos.pieces = pos.pieces.copy()
+    new_pos.occupancy = pos.occupancy.copy()
+    new_pos.board = pos.board.copy()
+    new_pos.side = pos.side
+    new_pos.enpas = pos.enpas
+    new_pos.castle = pos.castle
+    new_pos.hash_key = pos.hash_key
+    new_pos.pawn_key = pos.pawn_key
+    new_pos.mg_score = pos.mg_score
+    new_pos.eg_score = pos.eg_score
+    new_pos.phase = pos.phase
+    new_pos.halfmove = pos.halfmove
+    new_pos.null_distance = pos.null_distance
+
+    new_pos.undo_index = pos.undo_index
+    new_pos.undo_captured = pos.undo_captured.copy()
+    new_pos.undo_enpas = pos.undo_enpas.copy()
+    new_pos.undo_castle = pos.undo_castle.copy()
+    new_pos.undo_hash = pos.undo_hash.copy()
+    new_pos.undo_pawn_key = pos.undo_pawn_key.copy()
+    new_pos.undo_mg_score = pos.undo_mg_score.copy()
+    new_pos.undo_eg_score = pos.undo_eg_score.copy()
+    new_pos.undo_phase = pos.undo_phase.copy()
+    new_pos.undo_halfmove = pos.undo_halfmove.copy()
+    new_pos.undo_null_distance = pos.undo_null_distance.copy()
+
+    return new_pos
 
 
 def print_position(pos, print_info=False):
@@ -35,10 +132,7 @@ def print_position(pos, print_info=False):
             sq = np.uint8(_rank * 8 + _file)
             for _side in range(2):
                 if get_bit(pos.occupancy[_side], sq):
-                    for piece, bb in enumerate(pos.pieces[_side]):
-                        if get_bit(bb, sq):
-                            b += f" {piece_to_letter[_side][piece]} |"
-                            break
+                    b += f" {piece_to_letter[_side][pos.board[sq]]} |"
                     break
             # empty square
             else:
@@ -60,7 +154,29 @@ def print_position(pos, print_info=False):
         print("Hash key:", hex(pos.hash_key), "\n")
 
 
-@njit(nb.uint64(Position.class_type.instance_type))
+@njit(nb.uint64(position_type), cache=True)
+def enpas_key(pos):
+    """en passant hash key of a position, only set if a pawn of the side to move can take en passant (Polyglot)"""
+    if pos.enpas != no_sq and pawn_attacks[pos.side ^ 1][pos.enpas] & pos.pieces[pos.side][pawn]:
+        return en_passant_keys[pos.enpas]
+    return EMPTY
+
+
+@njit(nb.b1(position_type), cache=True)
+def is_repetition(pos):
+    """return True if the position already occurred since the last capture or pawn move
+
+    The undo stack holds the hash key before each move: only the positions with the same side
+    to move are compared, back to the last irreversible move or null move
+    (null_distance also stops the scan at the bottom of the stack)."""
+    last = min(pos.halfmove, pos.null_distance)
+    for i in range(4, last + 1, 2):
+        if pos.undo_hash[pos.undo_index - i] == pos.hash_key:
+            return True
+    return False
+
+
+@njit(nb.uint64(position_type), cache=True)
 def generate_hash_key(pos):
     """generate a hash_key from a position"""
 
@@ -70,29 +186,69 @@ def generate_hash_key(pos):
         for piece in range(6):
             bb = pos.pieces[color][piece]
             while bb:
-                square = get_ls1b_index(bb)
+                square, bb = pop_lsb(bb)
 
                 final_key ^= piece_keys[color][piece][square]
 
-                bb = pop_bit(bb, square)
-
-    # todo: get rid of it by having 65 sq array
-    if pos.enpas != no_sq:
-        final_key ^= en_passant_keys[pos.enpas]
+    final_key ^= enpas_key(pos)
 
     final_key ^= castle_keys[pos.castle]
 
-    if pos.side:
+    if pos.side == white:
         final_key ^= side_key
 
     return final_key
 
 
-@njit(Position.class_type.instance_type(nb.types.string))
+@njit(nb.uint64(position_type), cache=True)
+def generate_pawn_key(pos):
+    """generate a hash_key from the pawns of a position"""
+
+    final_key = 0
+
+    for color in range(2):
+        bb = pos.pieces[color][pawn]
+        while bb:
+            square, bb = pop_lsb(bb)
+
+            final_key ^= piece_keys[color][pawn][square]
+
+    return final_key
+
+
+@njit(cache=True)
+def update_piece_score(pos, color, piece, square, sign):
+    """add (sign=1) or remove (sign=-1) a piece from the material and PST scores"""
+    if color:
+        sign = -sign
+
+    pos.mg_score += sign * (material_scores[opening][piece] + PST[opening][piece][square])
+    pos.eg_score += sign * (material_scores[end_game][piece] + PST[end_game][piece][square])
+
+
+@njit(nb.void(position_type), cache=True)
+def init_scores(pos):
+    """compute material, PST and phase scores of a position from scratch"""
+
+    pos.mg_score = 0
+    pos.eg_score = 0
+    pos.phase = 0
+
+    for color in range(2):
+        for piece in range(6):
+            bb = pos.pieces[color][piece]
+            while bb:
+                square, bb = pop_lsb(bb)
+
+                update_piece_score(pos, color, piece, square, 1)
+                pos.phase += phase_scores[piece]
+
+
+@njit(position_type(nb.types.unicode_type), cache=True)
 def parse_fen(fen: str):
     """return a Position object from a Forsyth-Edwards Notation string"""
 
-    pos = Position()
+    pos = new_position()
 
     # numba dict helper
     num_str_to_int = nb.typed.Dict.empty(nb.types.string, nb.types.int64)
@@ -104,7 +260,7 @@ def parse_fen(fen: str):
         for code, letter in enumerate(side):
             let_str_to_int[letter] = code
 
-    board, color, castle, ep, _hclock, _fclock = fen.split()
+    board, color, castle, ep, hclock, _fclock = fen.split()
 
     pos.side = 0 if color == "w" else 1
 
@@ -116,6 +272,10 @@ def parse_fen(fen: str):
                 pos.enpas = i
                 break
 
+    pos.halfmove = 0
+    for c in hclock:
+        pos.halfmove = pos.halfmove * 10 + ord(c) - ord("0")
+
     pos.castle = 0
     for i, c in enumerate("KQkq"):
         if c in castle:
@@ -127,11 +287,13 @@ def parse_fen(fen: str):
         if c.isupper():  # White
             piece = let_str_to_int[c]
             pos.pieces[white][piece] = set_bit(pos.pieces[white][piece], sq)
+            pos.board[sq] = piece
             sq += 1
 
         elif c.islower():  # Black
             piece = let_str_to_int[c]
             pos.pieces[black][piece] = set_bit(pos.pieces[black][piece], sq)
+            pos.board[sq] = piece
             sq += 1
 
         elif c.isnumeric():  # Empty
@@ -144,5 +306,8 @@ def parse_fen(fen: str):
     pos.occupancy[both] = pos.occupancy[white] | pos.occupancy[black]
 
     pos.hash_key = generate_hash_key(pos)
+    pos.pawn_key = generate_pawn_key(pos)
+
+    init_scores(pos)
 
     return pos
@@ -1,5 +1,6 @@
 from constants import np, njit, \
     opening, end_game, pawn, knight, bishop, rook, queen, king, a8, h8, d5, e5, d4, e4, d3, e3, a1, h1
+from table_cache import load_tables
 
 PawnFileOpening = 5
 KnightCentreOpening = 5
@@ -93,4 +94,4 @@ def init_pst():
     return pst
 
 
-PST = init_pst()
+PST, = load_tables("pst", lambda: (init_pst(),))
@@ -1,153 +1,329 @@
 import time
+import threading
 
 from constants import *
 import constants
 from moves import *
-from bb_operations import get_ls1b_index
+from position import copy_position, position_type, is_repetition
+from jit_struct import JitStruct, define_fields, define_methods
+from table_cache import save_atomic
+from numba.experimental import structref
 from evaluation import evaluate, get_game_phase_score
 
 
+# the search and the uci threads write to stdout
+output_lock = threading.Lock()
+
+
+def uci_print(*args):
+    """print a line without mixing it with the lines of other threads"""
+    with output_lock:
+        print(*args, flush=True)
+
+
+@njit(nb.void(nb.types.unicode_type), cache=True)
+def uci_output(line):
+    """uci_print from compiled code (numba's print is not atomic)"""
+    with nb.objmode():
+        uci_print(line)
+
+
 def random_move(pos) -> int:
     """return a random legal move"""
     legal_moves = generate_legal_moves(pos)
     return np.random.choice(legal_moves) if legal_moves else None
 
 
-@nb.experimental.jitclass([
+@njit(cache=True)
+def hash_entry_check(move, score, depth, flag):
+    """return the bits xor-ed into the stored key of a transposition table entry,
+    so that an entry torn by concurrent writes of other threads does not validate"""
+    return (np.uint32(move) ^ np.uint32(score) ^ (np.uint32(depth) << 16) ^ (np.uint32(flag) << 24)) & 0xFFFFFFFF
+
+
+bot_spec = [
     ("nodes", nb.uint64),
     ("ply", nb.uint32),
-    ("killer_moves", nb.uint64[:, :]),
-    ("history_moves", nb.uint8[:, :, :]),
-    ("pv_table", nb.uint64[:, :]),
-    ("pv_length", nb.uint64[:]),
+    ("killer_moves", nb.uint64[:, ::1]),
+    ("history_moves", nb.int32[:, :, ::1]),
+    ("pv_table", nb.uint64[:, ::1]),
+    ("pv_length", nb.uint64[::1]),
+    ("move_lists", nb.uint64[:, ::1]),
+    ("move_scores", nb.int64[:, ::1]),
+    ("move_stage", nb.uint8[::1]),
+    ("move_index", nb.uint16[::1]),
+    ("move_count", nb.uint16[::1]),
+    ("bad_captures", nb.uint16[::1]),
+    ("capture_count", nb.uint16[::1]),
+    ("hash_moves", nb.uint64[::1]),
     ("follow_pv", nb.b1),
-    ("score_pv", nb.b1),
-    ("hash_table", hash_numba_type[:]),
-    ("repetition_table", nb.uint64[:]),
-    ("repetition_index", nb.uint16),
+    ("hash_table", hash_numba_type[:, ::1]),
+    ("hash_mask", nb.uint64),
+    ("age", nb.uint16),
+    ("pawn_table", pawn_hash_numba_type[::1]),
+    ("eval_table", eval_hash_numba_type[::1]),
+    ("eval_hash_mask", nb.uint64),
+    ("eval_probes", nb.uint64),
+    ("eval_hits", nb.uint64),
+    ("futility_margin", nb.int64),
+    ("reverse_futility_margin", nb.int64),
+    ("delta_margin", nb.int64),
     ("time_limit", nb.uint64),
     ("node_limit", nb.uint64),
     ("start", nb.uint64),
-    ("stopped", nb.b1)])
-class Black_numba:
-    def __init__(self):
-        self.nodes = 0
-        self.ply = 0
-        # Killer moves [id][ply]
-        self.killer_moves = np.zeros((2, MAX_PLY), dtype=np.uint64)
-        # History moves [side][piece][square]
-        self.history_moves = np.zeros((2, 6, 64), dtype=np.uint8)
-        # Principal Variation (PV)
-        self.pv_table = np.zeros((MAX_PLY, MAX_PLY), dtype=np.uint64)
-        self.pv_length = np.zeros(MAX_PLY, dtype=np.uint64)
-        self.follow_pv = False
-        self.score_pv = False
-        # Transposition Table
-        self.hash_table = np.zeros(MAX_HASH_SIZE, dtype=hash_numpy_type)
-        # Repetitions
-        self.repetition_table = np.zeros(1000, dtype=np.uint64)
-        self.repetition_index = 0
-        # Time management
-        self.time_limit = 1000
-        self.node_limit = 10**7
-        self.start = 0
-        self.stopped = True
+    ("stopped", nb.b1),
+    ("pondering", nb.b1),
+]
+
+
+@structref.register
+class BotType(nb.types.StructRef):
+    pass
+
+
+class Black_numba(JitStruct):
+    def __new__(cls, hash_size_mb=DEFAULT_HASH_MB, eval_hash_size=EVAL_HASH_SIZE):
+        return new_bot(hash_size_mb, eval_hash_size)
 
     def reset_bot(self, time_limit, node_limit):
+        """prepare a new search, the clock is started before with set_time_limit"""
         self.killer_moves = np.zeros((2, MAX_PLY), dtype=np.uint64)
-        self.history_moves = np.zeros((2, 6, 64), dtype=np.uint8)
+        self.history_moves = np.zeros((2, 6, 64), dtype=np.int32)
         self.pv_table = np.zeros((MAX_PLY, MAX_PLY), dtype=np.uint64)
         self.pv_length = np.zeros(MAX_PLY, dtype=np.uint64)
-        self.score_pv = False
         self.nodes = 0
-        self.stopped = False
-        self.time_limit = time_limit
+        self.eval_probes = 0
+        self.eval_hits = 0
         self.node_limit = node_limit
+        # entries from previous searches get older
+        self.age += 1
+        self.hash_table[0][0].age = self.age
+        self.time_limit = time_limit
+
+    def set_time_limit(self, time_limit):
+        """stop the search time_limit ms from now"""
         with nb.objmode(start=nb.uint64):
             start = time.time() * 1000
         self.start = start
+        self.time_limit = time_limit
 
-    def read_hash_entry(self, pos, depth, alpha, beta):
-        entry = self.hash_table[pos.hash_key % MAX_HASH_SIZE]
-
-        if entry.key == pos.hash_key:
-            if entry.depth >= depth:
-
-                score = entry.score
-                if score < -LOWER_MATE:
-                    score += self.ply
-                elif score > LOWER_MATE:
-                    score -= self.ply
-
-                if entry.flag == hash_flag_exact:
-                    return score
-                if entry.flag == hash_flag_alpha and entry.score <= alpha:
-                    return alpha
-                if entry.flag == hash_flag_beta and entry.score >= beta:
-                    return beta
-        return no_hash_entry
+    def resize_hash(self, hash_size_mb):
+        """allocate an empty transposition table of at most hash_size_mb megabytes (buckets)
+
+        An extra first row is not a bucket, the age of the table is kept in its first entry
+        so that a saved table carries its age."""
+        buckets = 1
+        while buckets * 2 * HASH_BUCKET_SIZE * HASH_ENTRY_SIZE <= hash_size_mb * 2 ** 20:
+            buckets *= 2
+        self.hash_table = np.zeros((buckets + 1, HASH_BUCKET_SIZE), dtype=hash_numpy_type)
+        self.hash_mask = buckets - 1
+        self.age = 0
+
+    def clear_hash(self):
+        """empty the transposition table, keeping its size"""
+        self.hash_table = np.zeros(self.hash_table.shape, dtype=hash_numpy_type)
+        self.age = 0
+
+    def save_hash(self, path):
+        """save the transposition table, with its age, to a .npy file"""
+        save_atomic(path, lambda f: np.save(f, self.hash_table))
+
+    def load_hash(self, path, write_back=False):
+        """use a transposition table saved by save_hash, memory-mapped so that it is read on demand.
+        Entries written by the search, and its age, go to the file only with write_back,
+        else they stay in memory."""
+        table = np.load(path, mmap_mode="r+" if write_back else "c")
+        buckets = table.shape[0] - 1
+        if table.dtype != hash_numpy_type or table.ndim != 2 or table.shape[1] != HASH_BUCKET_SIZE \
+                or buckets < 1 or buckets & (buckets - 1):
+            raise ValueError(f"{path} is not a transposition table")
+        self.hash_table = np.asarray(table)
+        self.hash_mask = buckets - 1
+        # the next search is one search younger than the last one saved
+        self.age = int(table[0, 0]["age"])
 
-    def write_hash_entry(self, pos, score, depth, hash_flag):
+    def read_hash_entry(self, pos, depth, alpha, beta):
+        """return (score or no_hash_entry, best move or 0) stored for this position"""
+        bucket = self.hash_table[np.uint64(1) + (pos.hash_key & self.hash_mask)]
+        # never 0, so that empty slots never match
+        key = (pos.hash_key >> 32) | 1
+
+        for slot in range(HASH_BUCKET_SIZE):
+            # copy the entry first, another thread may be writing it
+            entry = bucket[slot]
+            entry_key, move, entry_score, entry_depth, flag = \
+                entry.key, entry.move, entry.score, entry.depth, entry.flag
+
+            if entry_key ^ hash_entry_check(move, entry_score, entry_depth, flag) == key:
+                if entry_depth >= depth:
+
+                    score = entry_score
+                    if score < -LOWER_MATE:
+                        score += self.ply
+                    elif score > LOWER_MATE:
+                        score -= self.ply
+
+                    if flag == hash_flag_exact:
+                        return score, move
+                    if flag == hash_flag_alpha and entry_score <= alpha:
+                        return alpha, move
+                    if flag == hash_flag_beta and entry_score >= beta:
+                        return beta, move
+                return no_hash_entry, move
+
+        return no_hash_entry, np.uint32(0)
+
+    def write_hash_entry(self, pos, score, depth, hash_flag, move):
+        """store the entry in the slot of the same position if any (unless it holds a deeper
+        bound of this search), else replace the oldest and shallowest entry of the bucket"""
+
+        bucket = self.hash_table[np.uint64(1) + (pos.hash_key & self.hash_mask)]
+        key = (pos.hash_key >> 32) | 1
+
+        replace = 0
+        lowest_worth = BOUND_INF
+        for slot in range(HASH_BUCKET_SIZE):
+            entry = bucket[slot]
+            entry_move, entry_score, entry_depth, entry_flag = entry.move, entry.score, entry.depth, entry.flag
+            if entry.key ^ hash_entry_check(entry_move, entry_score, entry_depth, entry_flag) == key:
+                # keep the best move of a previous search if we don't have one
+                if not move:
+                    move = entry_move
+                # a shallower bound (reduced or null window search) does not replace
+                # a deeper entry of this search, only its best move is refreshed
+                if entry.age == self.age and depth < entry_depth and hash_flag != hash_flag_exact:
+                    entry.move = move
+                    entry.key = key ^ hash_entry_check(move, entry_score, entry_depth, entry_flag)
+                    return
+                replace = slot
+                break
 
-        i = pos.hash_key % MAX_HASH_SIZE
+            # an entry loses the value of 8 plies per search it survived
+            worth = bucket[slot].depth - 8 * ((self.age - bucket[slot].age) & 0xFFFF)
+            if worth < lowest_worth:
+                lowest_worth = worth
+                replace = slot
 
         if score < -LOWER_MATE:
             score -= self.ply
         elif score > LOWER_MATE:
             score += self.ply
 
-        self.hash_table[i].key = pos.hash_key
-        self.hash_table[i].depth = depth
-        self.hash_table[i].flag = hash_flag
-        self.hash_table[i].score = score
+        entry = bucket[replace]
+        entry.move = move
+        entry.score = score
+        entry.depth = depth
+        entry.flag = hash_flag
+        entry.age = self.age
+        entry.key = key ^ hash_entry_check(move, score, depth, hash_flag)
 
-    def is_repetition(self, pos):
-        if pos.hash_key in self.repetition_table[:self.repetition_index]:
-            return True
-        return False
+    def evaluate(self, pos):
+        """return the static evaluation of a position, probing the evaluation cache first"""
+        i = pos.hash_key & self.eval_hash_mask
+        self.eval_probes += 1
 
-    def communicate(self):
-        with nb.objmode(spent=nb.uint64):
-            spent = time.time() * 1000 - self.start
-        if spent > self.time_limit or self.nodes > self.node_limit:
-            self.stopped = True
+        if self.eval_table[i].key == pos.hash_key:
+            self.eval_hits += 1
+            return self.eval_table[i].score
 
+        score = evaluate(pos, self.pawn_table)
 
-@njit
-def enable_pv_scoring(bot, move_list):
-    bot.follow_pv = False
+        # always replace
+        self.eval_table[i].key = pos.hash_key
+        self.eval_table[i].score = score
 
-    if bot.pv_table[0][bot.ply] in move_list:
-        bot.score_pv = True
-        bot.follow_pv = True
+        return self.eval_table[i].score
+
+    def eval_hit_rate(self):
+        """return the evaluation cache hit rate of the last search, in percent"""
+        if not self.eval_probes:
+            return 0.0
+        return self.eval_hits * 100 / self.eval_probes
+
+    def communicate(self):
+        # self.start may be moved forward by another thread (ponderhit)
+        with nb.objmode(now=nb.uint64):
+            now = time.time() * 1000
+        if now > self.start + self.time_limit and not self.pondering or self.nodes > self.node_limit:
+            self.stopped = True
 
 
-@njit(nb.uint64(Black_numba.class_type.instance_type, Position.class_type.instance_type, nb.uint64), cache=True)
+structref.define_boxing(BotType, Black_numba)
+bot_type = BotType(bot_spec)
+define_fields(bot_type, Black_numba)
+define_methods(BotType, Black_numba, "reset_bot", "set_time_limit", "resize_hash", "clear_hash", "read_hash_entry",
+               "write_hash_entry", "evaluate", "eval_hit_rate", "communicate")
+
+
+@njit(bot_type(nb.int64, nb.int64), cache=True)
+def new_bot(hash_size_mb, eval_hash_size):
+    """return a new bot with a transposition table of at most hash_size_mb megabytes"""
+    bot = structref.new(bot_type)
+    bot.nodes = 0
+    bot.ply = 0
+    # Killer moves [id][ply]
+    bot.killer_moves = np.zeros((2, MAX_PLY), dtype=np.uint64)
+    # History moves [side][piece][square]
+    bot.history_moves = np.zeros((2, 6, 64), dtype=np.int32)
+    # Principal Variation (PV)
+    bot.pv_table = np.zeros((MAX_PLY, MAX_PLY), dtype=np.uint64)
+    bot.pv_length = np.zeros(MAX_PLY, dtype=np.uint64)
+    bot.follow_pv = False
+    # Move buffers [ply][move]
+    bot.move_lists = np.zeros((MAX_PLY, MAX_MOVES), dtype=np.uint64)
+    bot.move_scores = np.zeros((MAX_PLY, MAX_MOVES), dtype=np.int64)
+    # Move picker state [ply]
+    bot.move_stage = np.zeros(MAX_PLY, dtype=np.uint8)
+    bot.move_index = np.zeros(MAX_PLY, dtype=np.uint16)
+    bot.move_count = np.zeros(MAX_PLY, dtype=np.uint16)
+    # losing captures are left in the move list from bad_captures to capture_count
+    bot.bad_captures = np.zeros(MAX_PLY, dtype=np.uint16)
+    bot.capture_count = np.zeros(MAX_PLY, dtype=np.uint16)
+    bot.hash_moves = np.zeros(MAX_PLY, dtype=np.uint64)
+    # Transposition Table
+    bot.resize_hash(hash_size_mb)
+    # Pawn hash table
+    bot.pawn_table = np.zeros(PAWN_HASH_SIZE, dtype=pawn_hash_numpy_type)
+    # Evaluation cache
+    size = 1
+    while size * 2 <= eval_hash_size:
+        size *= 2
+    bot.eval_table = np.zeros(size, dtype=eval_hash_numpy_type)
+    bot.eval_hash_mask = size - 1
+    bot.eval_probes = 0
+    bot.eval_hits = 0
+    # Pruning margins
+    bot.futility_margin = FUTILITY_MARGIN
+    bot.reverse_futility_margin = REVERSE_FUTILITY_MARGIN
+    bot.delta_margin = DELTA_MARGIN
+    # Time management
+    bot.time_limit = 1000
+    bot.node_limit = 10**7
+    bot.start = 0
+    bot.stopped = False
+    # no time limit while pondering
+    bot.pondering = False
+    return bot
+
+
+@njit(nb.int64(bot_type, position_type, nb.uint64), cache=True)
 def score_move(bot, pos, move) -> int:
     """
     return a score representing the move potential
 
     ----- Move ordering -----
-    1. PV move
-    2. Captures in MVV/LVA
-    3. 1st and 2nd killer moves
-    4. History moves
-    5. Unsorted moves
+    1. Captures in MVV/LVA, losing ones (negative SEE) below 0
+    2. 1st and 2nd killer moves
+    3. History moves
+    4. Unsorted moves
     """
 
-    if bot.score_pv:  # PV move
-        if bot.pv_table[0][bot.ply] == move:
-            bot.score_pv = False
-            return 20000
-
     if get_move_capture(move):  # capture move
         attacker = get_move_piece(move)
-        victim_square = get_move_target(move)
-        victim = pawn  # in case of en-passant
-        for p, bb in enumerate(pos.pieces[pos.side ^ 1]):
-            if get_bit(bb, victim_square):
-                victim = p
-                break
+        # the target square of an en passant capture is empty
+        victim = pawn if get_move_enpas(move) else pos.board[get_move_target(move)]
+        if not see_ge(pos, move, 0):
+            return mvv_lva[attacker][victim] - 10000
         return mvv_lva[attacker][victim] + 10000
 
     else:  # quiet move
@@ -159,16 +335,137 @@ def score_move(bot, pos, move) -> int:
             return bot.history_moves[get_move_side(move)][get_move_piece(move)][get_move_target(move)]
 
 
-@njit
+@njit(nb.void(bot_type, position_type, nb.uint64[::1], nb.int64[::1], nb.int64), cache=True)
+def score_moves(bot, pos, move_list, move_scores, count):
+    """fill move_scores with the score of each move of move_list"""
+    for i in range(count):
+        move_scores[i] = score_move(bot, pos, move_list[i])
+
+
+@njit(nb.uint64(nb.uint64[::1], nb.int64[::1], nb.int64, nb.int64), cache=True)
+def pick_move(move_list, move_scores, start, count):
+    """swap the best scored move left in the list to start and return it"""
+    best = start
+    for i in range(start + 1, count):
+        if move_scores[i] > move_scores[best]:
+            best = i
+
+    move_list[start], move_list[best] = move_list[best], move_list[start]
+    move_scores[start], move_scores[best] = move_scores[best], move_scores[start]
+
+    return move_list[start]
+
+
+@njit(nb.void(bot_type, nb.uint64), cache=True)
+def init_move_picker(bot, hash_move):
+    """start picking the moves of the current ply, hash_move (if any) first"""
+    bot.move_stage[bot.ply] = stage_hash_move
+    bot.hash_moves[bot.ply] = hash_move
+
+
+@njit(nb.uint64(bot_type, position_type), cache=True)
+def next_move(bot, pos):
+    """
+    return the next move to search at the current ply, 0 when there is none left
+
+    Moves are generated and sorted lazily, stage after stage,
+    so a cut-off on an early move saves the work of the later stages.
+
+    ----- Move ordering -----
+    1. Hash move (PV move or transposition table move)
+    2. Winning and even captures and promotions in MVV/LVA
+    3. 1st and 2nd killer moves
+    4. Quiet moves by history
+    5. Losing captures (negative SEE)
+    """
+
+    ply = bot.ply
+    move_list = bot.move_lists[ply]
+    move_scores = bot.move_scores[ply]
+    hash_move = bot.hash_moves[ply]
+
+    while True:
+        stage = bot.move_stage[ply]
+
+        if stage == stage_hash_move:
+            bot.move_stage[ply] = stage_gen_captures
+            if hash_move and is_pseudo_legal(pos, hash_move):
+                return hash_move
+
+        elif stage == stage_gen_captures:
+            count = generate_captures(pos, move_list)
+            score_moves(bot, pos, move_list, move_scores, count)
+            bot.move_index[ply] = 0
+            bot.move_count[ply] = count
+            bot.move_stage[ply] = stage_captures
+
+        elif stage == stage_captures:
+            while bot.move_index[ply] < bot.move_count[ply]:
+                move = pick_move(move_list, move_scores, bot.move_index[ply], bot.move_count[ply])
+                if move_scores[bot.move_index[ply]] < 0:
+                    # only losing captures are left, they are tried after the quiet moves
+                    break
+                bot.move_index[ply] += 1
+                if move != hash_move:
+                    return move
+            bot.bad_captures[ply] = bot.move_index[ply]
+            bot.capture_count[ply] = bot.move_count[ply]
+            bot.move_index[ply] = 0
+            bot.move_stage[ply] = stage_killers
+
+        elif stage == stage_killers:
+            while bot.move_index[ply] < 2:
+                move = bot.killer_moves[bot.move_index[ply]][ply]
+                bot.move_index[ply] += 1
+                if move and move != hash_move and not get_move_capture(move) and not get_move_promote_to(move) \
+                        and is_pseudo_legal(pos, move):
+                    return move
+            bot.move_stage[ply] = stage_gen_quiets
+
+        elif stage == stage_gen_quiets:
+            # after the captures, the losing ones are still to be tried
+            start = bot.capture_count[ply]
+            count = generate_quiets(pos, move_list[start:])
+            score_moves(bot, pos, move_list[start:], move_scores[start:], count)
+            bot.move_index[ply] = start
+            bot.move_count[ply] = start + count
+            bot.move_stage[ply] = stage_quiets
+
+        elif stage == stage_quiets:
+            while bot.move_index[ply] < bot.move_count[ply]:
+                move = pick_move(move_list, move_scores, bot.move_index[ply], bot.move_count[ply])
+                bot.move_index[ply] += 1
+                if move != hash_move and move != bot.killer_moves[0][ply] and move != bot.killer_moves[1][ply]:
+                    return move
+            bot.move_index[ply] = bot.bad_captures[ply]
+            bot.move_count[ply] = bot.capture_count[ply]
+            bot.move_stage[ply] = stage_bad_captures
+
+        elif stage == stage_bad_captures:
+            while bot.move_index[ply] < bot.move_count[ply]:
+                move = pick_move(move_list, move_scores, bot.move_index[ply], bot.move_count[ply])
+                bot.move_index[ply] += 1
+                if move != hash_move:
+                    return move
+            bot.move_stage[ply] = stage_done
+
+        else:
+            return np.uint64(0)
+
+
+@njit(cache=True)
 def print_move_scores(bot, pos):
-    decorated_ml = [(m, score_move(bot, pos, m)) for m in generate_moves(pos)]
-    decorated_ml.sort(reverse=True, key=lambda m: m[1])
+    move_list = bot.move_lists[bot.ply]
+    move_scores = bot.move_scores[bot.ply]
+    count = generate_moves(pos, move_list)
+    score_moves(bot, pos, move_list, move_scores, count)
 
-    for move in decorated_ml:
-        print("move:", get_move_uci(move[0]), "score:", move[1])
+    for i in range(count):
+        move = pick_move(move_list, move_scores, i, count)
+        print("move:", get_move_uci(move), "score:", move_scores[i])
 
 
-@njit
+@njit(nb.int64(bot_type, position_type, nb.int64, nb.int64), cache=True)
 def quiescence(bot, pos, alpha, beta):
 
     if not bot.nodes & time_precision:
@@ -178,32 +475,46 @@ def quiescence(bot, pos, alpha, beta):
 
     # We are way too deep for lots of arrays
     if bot.ply > MAX_PLY - 1:
-        return evaluate(pos)
+        return bot.evaluate(pos)
 
-    evaluation = evaluate(pos)
+    evaluation = bot.evaluate(pos)
 
     if evaluation >= beta:
         return beta
 
     alpha = max(alpha, evaluation)
 
-    move_list = [(m, score_move(bot, pos, m)) for m in generate_moves(pos)]
-    move_list.sort(reverse=True, key=lambda m: m[1])
+    # only captures and promotions, quiet moves are never generated here
+    move_list = bot.move_lists[bot.ply]
+    move_scores = bot.move_scores[bot.ply]
+    count = generate_captures(pos, move_list)
+    score_moves(bot, pos, move_list, move_scores, count)
+    checkers, pinned = get_checkers_and_pinned(pos)
+
+    for i in range(count):
+        move = pick_move(move_list, move_scores, i, count)
+
+        if move_scores[i] < 0:
+            # only captures losing material (negative SEE) are left
+            break
+
+        # delta pruning: even winning the captured piece for free would not raise alpha
+        if not get_move_promote_to(move):
+            victim = pawn if get_move_enpas(move) else pos.board[get_move_target(move)]
+            if evaluation + see_values[victim] + bot.delta_margin <= alpha:
+                continue
 
-    for move, _ in move_list:
-        new_pos = make_move(pos, move, only_captures=True)
-        if new_pos is None:  # illegal move
+        if not is_legal(pos, move, checkers, pinned):
             continue
 
-        bot.ply += 1
+        make_move(pos, move, True)
 
-        bot.repetition_index += 1
-        bot.repetition_table[bot.repetition_index] = pos.hash_key
+        bot.ply += 1
 
-        score = -quiescence(bot, new_pos, -beta, -alpha)
+        score = -quiescence(bot, pos, -beta, -alpha)
 
+        unmake_move(pos, move)
         bot.ply -= 1
-        bot.repetition_index -= 1
 
         if bot.stopped:
             return 0
@@ -216,17 +527,24 @@ def quiescence(bot, pos, alpha, beta):
     return alpha
 
 
-@njit
+@njit(nb.int64(bot_type, position_type, nb.int64, nb.int64, nb.int64), cache=True)
 def negamax(bot, pos, depth, alpha, beta):
     """return the value of a position given a certain depth
     using alpha-beta search and optimisations"""
 
     hash_flag = hash_flag_alpha
 
-    if bot.ply and bot.is_repetition(pos):
-        return 0
+    if bot.ply:
+        if is_repetition(pos):
+            return 0
+
+        # fifty-move rule, unless the last move mated
+        if pos.halfmove >= 100 and bot.ply < MAX_PLY:
+            checkers, pinned = get_checkers_and_pinned(pos)
+            if checkers == EMPTY or generate_legal(pos, bot.move_lists[bot.ply]):
+                return 0
 
-    hash_entry = bot.read_hash_entry(pos, depth, alpha, beta)
+    hash_entry, hash_move = bot.read_hash_entry(pos, depth, alpha, beta)
 
     pv_node = beta - alpha > 1
 
@@ -245,30 +563,43 @@ def negamax(bot, pos, depth, alpha, beta):
 
     # We are way too deep for lots of arrays
     if bot.ply > MAX_PLY - 1:
-        return evaluate(pos)
+        return bot.evaluate(pos)
 
     bot.nodes += 1
 
-    in_check = is_square_attacked(pos, get_ls1b_index(pos.pieces[pos.side][5]), pos.side ^ 1)
+    checkers, pinned = get_checkers_and_pinned(pos)
+    in_check = checkers != EMPTY
     if in_check:
         depth += 1
 
     legal_moves = 0
 
+    # Static evaluation, to prune shallow nodes far from the window
+    static_eval = 0
+    if not pv_node and not in_check and bot.ply and depth <= max(futility_depth, reverse_futility_depth):
+        static_eval = bot.evaluate(pos)
+
+        # reverse futility pruning: too far above beta for the opponent to come back
+        if depth <= reverse_futility_depth and abs(beta) < LOWER_MATE \
+                and static_eval - bot.reverse_futility_margin * depth >= beta:
+            return beta
+
+    # frontier futility pruning: too far below alpha for a quiet move to raise it
+    futile = not pv_node and not in_check and bot.ply > 0 and depth <= futility_depth and abs(alpha) < LOWER_MATE \
+        and static_eval + bot.futility_margin * depth <= alpha
+
     # Null move pruning
     if depth >= 3 and not in_check and bot.ply:
 
         # try not moving
-        null_pos = make_null_move(pos)
+        make_null_move(pos)
 
         bot.ply += 1
 
-        bot.repetition_index += 1
-        bot.repetition_table[bot.repetition_index] = pos.hash_key
+        score = -negamax(bot, pos, depth - 1 - 2, -beta, -beta + 1)
 
-        score = -negamax(bot, null_pos, depth - 1 - 2, -beta, -beta + 1)
+        unmake_null_move(pos)
         bot.ply -= 1
-        bot.repetition_index -= 1
 
         if bot.stopped:
             return 0
@@ -276,52 +607,71 @@ def negamax(bot, pos, depth, alpha, beta):
         if score >= beta:
             return beta
 
-    move_list = generate_moves(pos)
     if bot.follow_pv:
-        enable_pv_scoring(bot, move_list)
+        # keep following the principal variation while its moves are playable
+        bot.follow_pv = is_pseudo_legal(pos, bot.pv_table[0][bot.ply])
 
-    # Decorate list with scores
-    move_list = [(m, score_move(bot, pos, m)) for m in move_list]
     # Move ordering
-    move_list.sort(reverse=True, key=lambda m: m[1])
+    init_move_picker(bot, bot.pv_table[0][bot.ply] if bot.follow_pv else hash_move)
 
     moves_searched = 0
+    best_move = np.uint64(0)
 
-    for move, _ in move_list:
+    while True:
+        move = next_move(bot, pos)
+        if not move:
+            break
 
-        new_pos = make_move(pos, move)
-        if new_pos is None:  # illegal move
+        if not is_legal(pos, move, checkers, pinned):
             continue
 
-        bot.ply += 1
-        bot.repetition_index += 1
-        bot.repetition_table[bot.repetition_index] = pos.hash_key
+        make_move(pos, move, True)
         legal_moves += 1
 
+        # quiet moves that do not give check can be pruned or reduced
+        quiet = not get_move_capture(move) and not get_move_promote_to(move) \
+            and not is_square_attacked(pos, get_ls1b_index(pos.pieces[pos.side][king]), pos.side ^ 1)
+
+        # futile quiet moves are not searched
+        # late move pruning: neither are the last quiet moves of shallow nodes
+        if quiet and (futile and moves_searched or not pv_node and not in_check and bot.ply
+                      and depth <= late_move_depth and legal_moves > late_move_counts[depth] and alpha > -LOWER_MATE):
+            unmake_move(pos, move)
+            continue
+
+        bot.ply += 1
+
         if moves_searched == 0:
-            score = -negamax(bot, new_pos, depth - 1, -beta, -alpha)
+            score = -negamax(bot, pos, depth - 1, -beta, -alpha)
 
         else:  # Late Move Reduction
 
             # condition to consider LMR
-            if moves_searched >= full_depth_moves and depth >= reduction_limit and\
-                    not in_check and not get_move_capture(move) and not get_move_promote_to(move):
+            if moves_searched >= full_depth_moves and depth >= reduction_limit and not in_check and quiet:
+                reduction = lmr_table[min(depth, MAX_PLY - 1)][min(moves_searched, MAX_MOVES - 1)]
+                if pv_node:
+                    reduction -= 1
+                history = bot.history_moves[get_move_side(move)][get_move_piece(move)][get_move_target(move)]
+                if history >= good_history:
+                    reduction -= 1
+                reduction = max(1, min(reduction, depth - 2))
+
                 # search with reduced depth and narrower window
-                score = - negamax(bot, new_pos, depth - 2, -alpha - 1, -alpha)
+                score = - negamax(bot, pos, depth - 1 - reduction, -alpha - 1, -alpha)
             else:
                 score = alpha + 1
 
             # Principal Variation Search (PVS)
             if score > alpha:   # if one of the late moves was actually good
                 # research with narrower window
-                score = -negamax(bot, new_pos, depth - 1, -alpha - 1, -alpha)
+                score = -negamax(bot, pos, depth - 1, -alpha - 1, -alpha)
 
                 if alpha < score < beta:    # the move was really good
                     # research with full depth
-                    score = -negamax(bot, new_pos, depth - 1, -beta, -alpha)
+                    score = -negamax(bot, pos, depth - 1, -beta, -alpha)
 
+        unmake_move(pos, move)
         bot.ply -= 1
-        bot.repetition_index -= 1
 
         if bot.stopped:
             return 0
@@ -331,6 +681,7 @@ def negamax(bot, pos, depth, alpha, beta):
         if score > alpha:
 
             hash_flag = hash_flag_exact
+            best_move = move
 
             if not get_move_capture(move):
                 # store history move
@@ -348,10 +699,10 @@ def negamax(bot, pos, depth, alpha, beta):
             # fail-hard beta cutoff
             if score >= beta:
 
-                bot.write_hash_entry(pos, beta, depth, hash_flag_beta)
+                bot.write_hash_entry(pos, beta, depth, hash_flag_beta, move)
 
                 # if quiet move
-                if not get_move_capture(move):
+                if not get_move_capture(move) and move != bot.killer_moves[0][bot.ply]:
                     bot.killer_moves[1][bot.ply] = bot.killer_moves[0][bot.ply]
                     bot.killer_moves[0][bot.ply] = move
                 # fail high
@@ -363,26 +714,41 @@ def negamax(bot, pos, depth, alpha, beta):
         else:  # stalemate
             return 0
 
-    bot.write_hash_entry(pos, alpha, depth, hash_flag)
+    bot.write_hash_entry(pos, alpha, depth, hash_flag, best_move)
 
     return alpha
 
 
-@njit
-def search(bot, pos, print_info=False, depth_limit=32, time_limit=1000, node_limit=10**7):
-    """return depth searched, best move, score (cp)"""
+@njit(nb.types.Tuple((nb.int64, nb.uint64, nb.int64))(bot_type, position_type, nb.b1, nb.int64, nb.int64, nb.int64,
+                                                       nb.int64), nogil=True, cache=True)
+def iterative_deepening(bot, pos, print_info, depth_limit, time_limit, node_limit, start_depth):
+    """return depth searched, best move, score (cp)
+
+    Runs without the GIL so that Lazy SMP helpers can search in parallel threads.
+    The clock is started before, with bot.set_time_limit (see search)."""
 
     bot.reset_bot(time_limit=time_limit, node_limit=node_limit)
 
     depth, value = 0, 0
     alpha, beta = -BOUND_INF, BOUND_INF
+    pv_length = bot.pv_length[0]
 
-    for depth in range(1, depth_limit + 1):
+    for depth in range(start_depth, depth_limit + 1):
         if bot.stopped or not -LOWER_MATE < value < LOWER_MATE:
             break
         bot.follow_pv = True
 
-        value = negamax(bot, pos, depth, alpha, beta)
+        score = negamax(bot, pos, depth, alpha, beta)
+
+        if bot.stopped:
+            # an interrupted iteration keeps the score and the PV of the previous one,
+            # unless it already found a new best move at the root
+            if not bot.pv_length[0]:
+                bot.pv_length[0] = pv_length
+            break
+
+        value = score
+        pv_length = bot.pv_length[0]
 
         if value <= alpha or value >= beta:
             alpha, beta = -BOUND_INF, BOUND_INF
@@ -400,7 +766,8 @@ def search(bot, pos, print_info=False, depth_limit=32, time_limit=1000, node_lim
                 s_score = "cp"
                 score = value
 
-            print("info", "depth", depth, "score", s_score, int(score), "nodes", bot.nodes, "pv", pv_line)
+            uci_output("info depth " + str(depth) + " score " + s_score + " " + str(int(score))
+                       + " nodes " + str(bot.nodes) + " pv " + pv_line)
 
             # with nb.objmode(ms_spent=nb.float64):
             #     ms_spent = time.time() * 1000 - bot.start
@@ -408,5 +775,70 @@ def search(bot, pos, print_info=False, depth_limit=32, time_limit=1000, node_lim
             # print("info", "depth", depth, "score", s_score, score, "nodes", bot.nodes,
             #       "nps", nps, "time", int(ms_spent), "pv", pv_line)
 
+    if print_info:
+        uci_output("info string eval cache hit rate " + str(int(bot.eval_hit_rate())) + " %")
+
     # print(score == bot.read_hash_entry(pos, depth, alpha, beta))
     return depth, bot.pv_table[0][0], value
+
+
+@njit(nb.void(bot_type, bot_type), cache=True)
+def share_search(bot, helper):
+    """prepare a Lazy SMP helper for the search of the main bot: same transposition table, clock and margins"""
+    helper.hash_table = bot.hash_table
+    helper.hash_mask = bot.hash_mask
+    helper.age = bot.age
+    helper.start = bot.start
+    helper.pondering = bot.pondering
+    helper.stopped = False
+    helper.futility_margin = bot.futility_margin
+    helper.reverse_futility_margin = bot.reverse_futility_margin
+    helper.delta_margin = bot.delta_margin
+
+
+def get_helpers(bot, count):
+    """return count Lazy SMP helper bots, kept on the main bot from one search to the next
+    so that a search does not spend its time allocating their tables"""
+    helpers = bot.__dict__.setdefault("_helpers", [])
+    while len(helpers) < count:
+        helpers.append(Black_numba(hash_size_mb=0))
+    return helpers[:count]
+
+
+def search(bot, pos, print_info=False, depth_limit=32, time_limit=1000, node_limit=10**7, threads=1):
+    """return depth searched, best move, score (cp)
+
+    With threads > 1, Lazy SMP: helper bots search the same root in parallel threads,
+    half of them starting one ply deeper, and share the transposition table of the main bot.
+    The main thread's result is returned.
+
+    bot.stopped can be set from another thread to stop the search."""
+
+    # the time spent starting the helpers counts
+    bot.set_time_limit(time_limit)
+
+    helpers = get_helpers(bot, threads - 1)
+    workers = []
+    for i, helper in enumerate(helpers, 1):
+        share_search(bot, helper)
+        workers.append(threading.Thread(
+            target=iterative_deepening,
+            args=(helper, copy_position(pos), False, depth_limit, time_limit, node_limit, 1 + i % 2),
+            daemon=True,
+        ))
+
+    for worker in workers:
+        worker.start()
+
+    result = iterative_deepening(bot, pos, print_info, depth_limit, time_limit, node_limit, 1)
+
+    for helper in helpers:
+        helper.stopped = True
+    for worker in workers:
+        worker.join()
+
+    # a stop request is only cleared once the search is over, not when it starts,
+    # so that it is not lost if it comes before the search thread is running
+    bot.stopped = False
+
+    return result
@@ -0,0 +1,116 @@
+import hashlib
+import os
+import shutil
+
+import numba
+import numpy as np
+from numba.core.caching import _CacheLocator
+
+"""
+On-disk caches of the precomputed tables (attack tables, masks, PST) and of the compiled code
+
+Each group of tables is saved as .npy files in a directory named after a fingerprint
+of the table version and of the modules generating them, so that editing one of these
+modules regenerates the tables. Cached tables are memory-mapped (read only) on load.
+
+Numba only invalidates the cache of a function when its own file changes, but compiled
+functions embed the code of the functions they call and the tables they read: the whole
+numba cache is cleared when any module of the engine changes.
+"""
+
+# bump to regenerate every cached table
+TABLES_VERSION = 1
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "__pycache__", "tables")
+
+# modules whose content defines the tables
+TABLE_SOURCES = ("constants.py", "bb_operations.py", "attack_tables.py", "pst.py")
+
+
+# modules whose content defines the compiled code
+JIT_SOURCES = TABLE_SOURCES + ("polyglot.py", "jit_struct.py", "position.py", "moves.py", "evaluation.py", "search.py", "perft.py",
+                               "table_cache.py")
+
+# where numba writes the cache files of the engine modules: __pycache__, or a subdirectory
+# named after this directory in NUMBA_CACHE_DIR if set
+if numba.config.CACHE_DIR:
+    JIT_CACHE_DIR = os.path.join(numba.config.CACHE_DIR, _CacheLocator.get_suitable_cache_subpath(__file__))
+else:
+    JIT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "__pycache__")
+
+
+def fingerprint(version, sources):
+    """hash of a version string and of the content of source files"""
+    h = hashlib.sha1(version.encode())
+    for source in sources:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), source), "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()[:16]
+
+
+def tables_fingerprint():
+    """hash of the table version, numpy version and table sources"""
+    return fingerprint(f"{TABLES_VERSION} {np.__version__}", TABLE_SOURCES)
+
+
+def clear_stale_jit_cache():
+    """remove the numba cache files if any module of the engine changed since they were written"""
+    fp = fingerprint(numba.__version__, JIT_SOURCES)
+    path = os.path.join(JIT_CACHE_DIR, "jit_fingerprint")
+
+    try:
+        with open(path) as f:
+            if f.read() == fp:
+                return
+    except OSError:
+        pass
+
+    try:
+        os.makedirs(JIT_CACHE_DIR, exist_ok=True)
+        for name in os.listdir(JIT_CACHE_DIR):
+            if name.endswith((".nbi", ".nbc")):
+                os.remove(os.path.join(JIT_CACHE_DIR, name))
+        save_atomic(path, lambda f: f.write(fp.encode()))
+    except OSError:  # read only install
+        pass
+
+
+def load_tables(name, build):
+    """return the tuple of arrays generated by build() from the cache,
+    building and saving them first if missing or stale"""
+    directory = os.path.join(CACHE_DIR, f"{name}-{tables_fingerprint()}")
+
+    # the number of tables is written last, once all of them are complete
+    try:
+        with open(os.path.join(directory, "count")) as f:
+            count = int(f.read())
+        return tuple(np.asarray(np.load(os.path.join(directory, f"{i}.npy"), mmap_mode="r"))
+                     for i in range(count))
+    except (OSError, ValueError):
+        pass
+
+    tables = build()
+
+    try:
+        # remove the tables of older versions
+        for old in os.listdir(CACHE_DIR) if os.path.isdir(CACHE_DIR) else ():
+            if old.startswith(f"{name}-") and os.path.join(CACHE_DIR, old) != directory:
+                shutil.rmtree(os.path.join(CACHE_DIR, old), ignore_errors=True)
+
+        os.makedirs(directory, exist_ok=True)
+        for i, table in enumerate(tables):
+            save_atomic(os.path.join(directory, f"{i}.npy"), lambda f: np.save(f, table))
+        save_atomic(os.path.join(directory, "count"), lambda f: f.write(str(len(tables)).encode()))
+
+    except OSError:  # read only install, keep the tables in memory
+        pass
+
+    return tables
+
+
+def save_atomic(path, write):
+    """write a file through a temporary one so that concurrent engines never read a partial file"""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        write(f)
+    os.replace(tmp, path)
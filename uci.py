@@ -1,19 +1,32 @@
 import sys
+import threading
 import time
 
 from position import parse_fen, print_position
-from constants import start_position
+from constants import start_position, DEFAULT_HASH_MB, MIN_HASH_MB, MAX_HASH_MB, MAX_THREADS
 from moves import make_move, parse_move, get_move_uci
-from search import Black_numba, random_move, search
+from search import Black_numba, get_helpers, random_move, search, uci_print
 from perft import uci_perft
 
+# default transposition table file of the Save Hash / Load Hash options
+HASH_FILE = "black_numba_hash.npy"
+
+# limits of go infinite and go ponder
+INFINITE_DEPTH = 32
+INFINITE_TIME = 10 ** 12
+
 
 class Game:
-    def __init__(self):
+    def __init__(self, bot=None, threads=1, hash_file=HASH_FILE):
         self.pos = parse_fen(start_position)
-        self.bot = Black_numba()
+        self.bot = Black_numba() if bot is None else bot
+        self.threads = threads
         self.moves = []
-        self.root = True
+        self.hash_file = hash_file
+        # background search, its bestmove is sent once answer is set
+        self.search_thread = None
+        self.answer = threading.Event()
+        self.time_limit = 0
 
 
 def parse_position(command, game):
@@ -27,22 +40,23 @@ def parse_position(command, game):
     index = command.find("moves")
     move_list = [] if index == -1 else command[index:].split()[1:]
 
-    if not game.root:
-        move = parse_move(game.pos, move_list[-1])
-        game.pos = make_move(game.pos, move)
-        game.root = False
+    # the moves are made in place, from a new position each time
+    if param[1] == "fen":
+        fen_part = command if index == -1 else command[:index]
+        _, _, fen = fen_part.split(maxsplit=2)
+        game.pos = parse_fen(fen)
     else:
-        if param[1] == "fen":
-            fen_part = command if index == -1 else command[:index]
-            _, _, fen = fen_part.split(maxsplit=2)
-            game.pos = parse_fen(fen)
-        for uci_move in move_list:
-            move = parse_move(game.pos, uci_move)
-            game.pos = make_move(game.pos, move)
+        game.pos = parse_fen(start_position)
+
+    for uci_move in move_list:
+        move = parse_move(game.pos, uci_move)
+        if not move or not make_move(game.pos, move):
+            print(f"info string illegal move {uci_move}")
+            break
 
 
 def parse_go(command, game):
-    """parse 'go' uci command"""
+    """parse 'go' uci command and start searching in the background"""
 
     d = 12
     t = 60000
@@ -50,11 +64,16 @@ def parse_go(command, game):
 
     _, *params = command.split()
 
+    # search until stop, or until stop or ponderhit when pondering, before sending bestmove
+    ponder = "ponder" in params
+    infinite = "infinite" in params
+    params = [p for p in params if p not in ("ponder", "infinite")]
+
     # vivement 3.10!
     for p, v in zip(*2 * (iter(params),)):
         print(p, v)
         if p == "perft":
-            uci_perft(game.pos, depth=5)
+            uci_perft(game.pos, depth=int(v), threads=game.threads)
             return
         elif p == "depth":
             d = int(v)
@@ -69,14 +88,88 @@ def parse_go(command, game):
             if game.pos.side:
                 t = int(v) // 40
 
+    if infinite:
+        d, t = INFINITE_DEPTH, INFINITE_TIME
+
+    game.time_limit = t
+    game.bot.stopped = False
+    game.bot.pondering = ponder
+    if ponder or infinite:
+        game.answer.clear()
+    else:
+        game.answer.set()
+
+    game.search_thread = threading.Thread(target=search_and_answer, args=(game, d, t, n), daemon=True)
+    game.search_thread.start()
+
+
+def search_and_answer(game, depth_limit, time_limit, node_limit):
+    """search thread: search the position then send bestmove"""
+
     _, move, _ = search(
-        game.bot, game.pos, print_info=True, depth_limit=d, time_limit=t, node_limit=n
+        game.bot, game.pos, print_info=True, depth_limit=depth_limit, time_limit=time_limit, node_limit=node_limit,
+        threads=game.threads
     )
 
+    game.answer.wait()
+
+    # stopped before the end of the first iteration
+    if not move:
+        move = random_move(game.pos)
+        if move is None:
+            uci_print("bestmove 0000")
+            return
+
     best_move = get_move_uci(move)
-    ponder = get_move_uci(game.bot.pv_table[0][1])
 
-    print(f"bestmove {best_move} ponder {ponder}")
+    # the reply of the principal variation, if it goes that far
+    pv = game.bot.pv_table[0]
+    if move == pv[0] and game.bot.pv_length[0] > 1 and pv[1]:
+        uci_print(f"bestmove {best_move} ponder {get_move_uci(pv[1])}")
+    else:
+        uci_print(f"bestmove {best_move}")
+
+
+def stop_search(game):
+    """stop the search thread, if any, and wait for its bestmove"""
+    if game.search_thread is not None:
+        game.bot.stopped = True
+        game.answer.set()
+        game.search_thread.join()
+        game.search_thread = None
+
+
+def parse_setoption(command, game):
+    """
+    parse 'setoption' uci command
+    eg: setoption name Hash value 128
+    """
+
+    _, _, name_value = command.partition(" name ")
+    name, _, value = name_value.partition(" value ")
+    name = name.strip().lower()
+
+    if name == "hash":
+        size = min(max(int(value), MIN_HASH_MB), MAX_HASH_MB)
+        game.bot.resize_hash(size)
+    elif name == "clear hash":
+        game.bot.clear_hash()
+    elif name == "threads":
+        game.threads = min(max(int(value), 1), MAX_THREADS)
+        # allocate the helper bots now rather than during the next search
+        get_helpers(game.bot, game.threads - 1)
+    elif name == "hash file":
+        game.hash_file = value.strip()
+    elif name == "save hash":
+        try:
+            game.bot.save_hash(game.hash_file)
+        except OSError as e:
+            print(f"info string cannot save hash: {e}")
+    elif name == "load hash":
+        try:
+            game.bot.load_hash(game.hash_file)
+        except (OSError, ValueError) as e:
+            print(f"info string cannot load hash: {e}")
 
 
 def main():
@@ -85,6 +178,9 @@ def main():
     This implements a slice of the UCI protocol.
     """
 
+    # the search thread writes while this one waits for input
+    sys.stdout.reconfigure(line_buffering=True)
+
     game = Game()
 
     while True:
@@ -92,23 +188,49 @@ def main():
         print(f">>> {msg}", file=sys.stderr)
 
         if msg == "quit":
+            stop_search(game)
             break
 
+        elif msg == "stop":
+            stop_search(game)
+
+        elif msg == "ponderhit":
+            # the expected move was played, the search goes on with its time limit from now
+            game.bot.set_time_limit(game.time_limit)
+            game.bot.pondering = False
+            game.answer.set()
+
         elif msg == "uci":
             print("id name black_numba")
             print("id author Avo-k")
+            print(f"option name Hash type spin default {DEFAULT_HASH_MB} min {MIN_HASH_MB} max {MAX_HASH_MB}")
+            print("option name Clear Hash type button")
+            print(f"option name Threads type spin default 1 min 1 max {MAX_THREADS}")
+            print(f"option name Hash File type string default {HASH_FILE}")
+            print("option name Save Hash type button")
+            print("option name Load Hash type button")
             print("uciok")
 
         elif msg == "isready":
-            print("readyok")
+            uci_print("readyok")
+
+        elif msg[:9] == "setoption":
+            stop_search(game)
+            parse_setoption(msg, game)
 
         elif msg == "ucinewgame":
-            game = Game()
+            stop_search(game)
+            # keep the bot and its table size, forget what it searched
+            # (Load Hash after ucinewgame to start from a saved table)
+            game.bot.clear_hash()
+            game = Game(game.bot, game.threads, game.hash_file)
 
         elif msg[:8] == "position":
+            stop_search(game)
             parse_position(msg, game)
 
         elif msg[:2] == "go":
+            stop_search(game)
             parse_go(msg, game)
 
         elif msg == "d":
@@ -121,6 +243,7 @@ def main():
 if __name__ == "__main__":
     print("compiling...")
     compiling_time = time.perf_counter()
-    search(Black_numba(), parse_fen(start_position), print_info=False, depth_limit=2)
+    # with a helper thread, so that the first multi-threaded search does not load its code
+    search(Black_numba(), parse_fen(start_position), print_info=False, depth_limit=2, threads=2)
     print(f"compiled in {time.perf_counter() - compiling_time:.2f} seconds")
     main()